@@ -1,10 +1,24 @@
 import streamlit as st
 import pandas as pd
-import pydeck as pdk
-import plotly.express as px
-from openai import OpenAI
 from os import getenv
 from utils.db import init_db, SessionLocal, Object, Inspection, Defect
+from utils.map_utils import (
+    cluster_layer_data, compact_layer_data, degrees_per_pixel, render_tooltip,
+    viewport_bbox, zoom_for_bounds,
+)
+from utils.data_utils import (
+    KpiFilters, MapFilters, compute_kpis, load_diagnostics, diagnostics_options,
+    map_options, map_counts, load_viewport_objects, load_clusters,
+)
+from utils.import_utils import DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, read_csv_typed
+from utils.report_utils import (
+    ReportBatchRunner, ReportBuilder, ReportUsage, batch_archive, batch_progress, batch_usage,
+    cached_report, report_inputs, risk_objects, stream_report,
+)
+from utils.jobs import (
+    ACTIVE_STATUSES, RESUMABLE_STATUSES, ImportJobRunner, get_job, job_fraction, recent_jobs,
+)
+import time
 from datetime import datetime
 from sqlalchemy import func
 
@@ -18,16 +32,6 @@ st.set_page_config(
 init_db()
 
 
-if "objects_df" not in st.session_state:
-    st.session_state.objects_df = None
-
-if "diagnostics_df" not in st.session_state:
-    st.session_state.diagnostics_df = None
-
-if "processed_df" not in st.session_state:
-    st.session_state.processed_df = None
-
-
 UI_TEXTS = {
     "ru": {
         "lang_name": "Русский",
@@ -39,6 +43,22 @@ UI_TEXTS = {
         "load_btn": "Загрузить и обработать",
         "import_success": "Данные успешно загружены!",
         "import_first": "Сначала импортируйте данные.",
+        "import_rejected": "Строк отклонено (нет object_id или даты)",
+        "import_duplicates": "Повторов в файле (взята последняя строка)",
+        "import_rows": "Строк обработано",
+        "import_rate": "строк/с",
+        "import_eta": "Осталось",
+        "import_cancel": "Отменить импорт",
+        "import_cancel_requested": "Импорт остановится после текущего куска.",
+        "import_resume": "Продолжить",
+        "import_jobs_resumable": "Незавершённые импорты",
+        "import_status_queued": "в очереди",
+        "import_status_running": "выполняется",
+        "import_status_done": "готово",
+        "import_status_failed": "Ошибка импорта",
+        "import_status_cancelled": "Импорт отменён",
+        "import_status_interrupted": "Импорт прерван",
+        "import_progress": "Импорт диагностик…",
         "no_latlon": "В данных отсутствуют координаты (lat/lon).",
 
         
@@ -57,6 +77,14 @@ UI_TEXTS = {
         "high_metric": "High-крит.",
         "medium_metric": "Medium-крит.",
         "no_objects_for_filters": "Объекты не найдены для выбранных фильтров.",
+        "map_compact": "Компактная передача карты",
+        "map_compact_help": "В браузер отправляются только координаты и цвета, подробности объекта — по клику.",
+        "map_pick_hint": "Нажмите на точку, чтобы увидеть подробности объекта.",
+        "map_viewport": "Окно карты",
+        "map_zoom": "Масштаб",
+        "map_center_lat": "Центр: широта",
+        "map_center_lon": "Центр: долгота",
+        "map_clustered": "В окне {count} объектов — показаны кластеры. Увеличьте масштаб, чтобы увидеть отдельные объекты.",
 
         
         "defects_title": "Список дефектов / диагностик",
@@ -126,6 +154,22 @@ UI_TEXTS = {
         "load_btn": "Жүктеу және өңдеу",
         "import_success": "Деректер сәтті жүктелді!",
         "import_first": "Алдымен деректерді жүктеңіз.",
+        "import_rejected": "Қабылданбаған жолдар (object_id немесе күн жоқ)",
+        "import_duplicates": "Файлдағы қайталанулар (соңғы жол алынды)",
+        "import_rows": "Өңделген жолдар",
+        "import_rate": "жол/с",
+        "import_eta": "Қалды",
+        "import_cancel": "Импортты тоқтату",
+        "import_cancel_requested": "Импорт ағымдағы бөліктен кейін тоқтайды.",
+        "import_resume": "Жалғастыру",
+        "import_jobs_resumable": "Аяқталмаған импорттар",
+        "import_status_queued": "кезекте",
+        "import_status_running": "орындалуда",
+        "import_status_done": "дайын",
+        "import_status_failed": "Импорт қатесі",
+        "import_status_cancelled": "Импорт тоқтатылды",
+        "import_status_interrupted": "Импорт үзілді",
+        "import_progress": "Диагностика импорты…",
         "no_latlon": "lat/lon координаттары жоқ.",
 
         
@@ -144,6 +188,14 @@ UI_TEXTS = {
         "high_metric": "Жоғары крит.",
         "medium_metric": "Орта крит.",
         "no_objects_for_filters": "Сүзгі бойынша объект жоқ.",
+        "map_compact": "Картаны ықшам жіберу",
+        "map_compact_help": "Браузерге тек координаттар мен түстер жіберіледі, объект мәліметтері — басқанда.",
+        "map_pick_hint": "Объект мәліметтерін көру үшін нүктені басыңыз.",
+        "map_viewport": "Карта терезесі",
+        "map_zoom": "Масштаб",
+        "map_center_lat": "Орталық: ендік",
+        "map_center_lon": "Орталық: бойлық",
+        "map_clustered": "Терезеде {count} объект — кластерлер көрсетілген. Жеке объектілерді көру үшін масштабты үлкейтіңіз.",
 
         
         "defects_title": "Ақаулар тізімі",
@@ -213,6 +265,22 @@ UI_TEXTS = {
         "load_btn": "Upload and process",
         "import_success": "Data loaded successfully!",
         "import_first": "Please upload data first.",
+        "import_rejected": "Rows rejected (missing object_id or date)",
+        "import_duplicates": "Duplicate rows in file (last one kept)",
+        "import_rows": "Rows processed",
+        "import_rate": "rows/s",
+        "import_eta": "Remaining",
+        "import_cancel": "Cancel import",
+        "import_cancel_requested": "The import will stop after the current chunk.",
+        "import_resume": "Resume",
+        "import_jobs_resumable": "Unfinished imports",
+        "import_status_queued": "queued",
+        "import_status_running": "running",
+        "import_status_done": "done",
+        "import_status_failed": "Import failed",
+        "import_status_cancelled": "Import cancelled",
+        "import_status_interrupted": "Import interrupted",
+        "import_progress": "Importing diagnostics…",
         "no_latlon": "Missing coordinates (lat/lon).",
 
         
@@ -231,6 +299,14 @@ UI_TEXTS = {
         "high_metric": "High crit.",
         "medium_metric": "Medium crit.",
         "no_objects_for_filters": "No objects for selected filters.",
+        "map_compact": "Compact map transport",
+        "map_compact_help": "Only positions and colors are sent to the browser; object details load on click.",
+        "map_pick_hint": "Click a point to see the object details.",
+        "map_viewport": "Map viewport",
+        "map_zoom": "Zoom",
+        "map_center_lat": "Center latitude",
+        "map_center_lon": "Center longitude",
+        "map_clustered": "{count} objects in view — showing clusters. Zoom in to see individual objects.",
 
       
         "defects_title": "Diagnostics list",
@@ -324,6 +400,48 @@ CRIT_LABELS = {
 }
 
 
+TOOLTIP_LABELS = {
+    "ru": {
+        "type": "Тип объекта", "crit": "Критичность", "region": "Область",
+        "water_type": "Тип воды", "fauna": "Фауна", "passport": "Дата паспорта",
+        "tech": "Тех. состояние", "coords": "Координаты", "center": "Центр",
+        "north": "Север", "south": "Юг", "east": "Восток", "west": "Запад",
+    },
+    "kk": {
+        "type": "Объект түрі", "crit": "Критикалылық", "region": "Облыс",
+        "water_type": "Су түрі", "fauna": "Фауна", "passport": "Паспорт күні",
+        "tech": "Тех. жағдай", "coords": "Координаттар", "center": "Ортасы",
+        "north": "Солтүстік", "south": "Оңтүстік", "east": "Шығыс", "west": "Батыс",
+    },
+    "en": {
+        "type": "Type", "crit": "Criticality", "region": "Region",
+        "water_type": "Water type", "fauna": "Fauna", "passport": "Passport date",
+        "tech": "Tech state", "coords": "Coordinates", "center": "Center",
+        "north": "North", "south": "South", "east": "East", "west": "West",
+    },
+}
+
+# Что уходит в ScatterplotLayer: координаты, цвет и поля подсказки.
+MAP_LAYER_COLUMNS = [
+    "object_id", "lon", "lat", "r", "g", "b",
+    "name_ui", "region_ui", "type_ui", "water_type_ui", "fauna_ui",
+    "passport_date_ui", "tech_state_ui", "crit_ui",
+    "coords_center_ui", "coords_north_ui", "coords_south_ui",
+    "coords_east_ui", "coords_west_ui",
+]
+
+OBJECT_TABLE_COLUMNS = ["object_id", "name", "type", "criticality", "lat", "lon"]
+
+# Окно карты в пикселях — по нему считаем видимый прямоугольник.
+MAP_WIDTH_PX = 1000
+MAP_HEIGHT_PX = 500
+# Больше точек в окне — показываем кластеры сетки размером CLUSTER_CELL_PX.
+MAP_MAX_POINTS = int(getenv("MAP_MAX_POINTS", 5000))
+CLUSTER_CELL_PX = 48
+
+# Как часто перерисовываем отчёт во время потоковой генерации (если абзац не закончился).
+REPORT_REFRESH_SEC = 0.2
+
 
 if "ui_lang" not in st.session_state:
     st.session_state.ui_lang = "ru"
@@ -338,88 +456,70 @@ def t(key: str) -> str:
 
 
 
-def import_objects_to_db(objects_df: pd.DataFrame):
-    """Сохраняем данные Objects.csv в таблицу objects."""
-    session = SessionLocal()
-    try:
-        for _, row in objects_df.iterrows():
-            try:
-                obj = Object(
-                    id=int(row["object_id"]),
-                    object_name=str(row.get("object_name", "")),
-                    object_type=str(row.get("object_type", "")),
-                    pipeline=str(row.get("pipeline", "")),
-                    lat=float(row["lat"]) if "lat" in row and pd.notna(row["lat"]) else None,
-                    lon=float(row["lon"]) if "lon" in row and pd.notna(row["lon"]) else None,
-                    year=int(row["year"]) if "year" in row and pd.notna(row["year"]) else None,
-                    material=str(row.get("material", "")),
-                )
-                session.merge(obj)   
-            except Exception as e:
-                print("Ошибка при импорте объекта:", e)
-                continue
-        session.commit()
-    finally:
-        session.close()
+IMPORT_BATCH_SIZE = int(getenv("IMPORT_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+IMPORT_CHUNK_SIZE = int(getenv("IMPORT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+# >1 — разбор диагностик в пуле процессов (import_diagnostics_parallel)
+IMPORT_PARSE_WORKERS = int(getenv("IMPORT_PARSE_WORKERS", 1))
 
 
-def import_diagnostics_to_db(diagnostics_df: pd.DataFrame):
-    """Сохраняем Diagnostics.csv в таблицы inspections и defects."""
-    session = SessionLocal()
-    try:
-        for idx, row in diagnostics_df.iterrows():
-            try:
-           
-                diag_id = int(idx) + 1
-
-               
-                date_raw = row.get("date", None)
-                date_parsed = pd.to_datetime(date_raw, errors="coerce")
-                if pd.isna(date_parsed):
-                    continue
-
-               
-                severity_raw = str(row.get("severity", "")).strip()
-                severity_lower = severity_raw.lower()
-                defect_found = severity_lower != "low"  
-
-                insp = Inspection(
-                    id=diag_id,
-                    object_id=int(row["object_id"]),
-                    date=date_parsed.date(),
-                    method=str(row.get("method", "")),
-                    temperature=None,
-                    humidity=None,
-                    illumination=None,
-                    defect_found=defect_found,
-                    defect_descr=str(row.get("description", "")),
-                    quality_grade=None,
-                    param1=None,
-                    param2=None,
-                    param3=None,
-                    ml_label=severity_lower,  
-                )
-                session.merge(insp)
+@st.cache_resource
+def get_import_runner() -> ImportJobRunner:
+    """Один исполнитель импорта на процесс Streamlit: задачи живут дольше сессии браузера."""
+    return ImportJobRunner(
+        chunk_size=IMPORT_CHUNK_SIZE,
+        batch_size=IMPORT_BATCH_SIZE,
+        parse_workers=IMPORT_PARSE_WORKERS,
+    )
 
-                
-                if defect_found:
-                    defect = Defect(
-                        inspection_id=insp.id,
-                        depth=None,
-                        length=None,
-                        width=None,
-                        severity=severity_lower,
-                        description=insp.defect_descr,
-                    )
-                    session.add(defect)
-
-            except Exception as e:
-                print("Ошибка при импорте диагностики:", e)
-                continue
-
-        session.commit()
-    finally:
-        session.close()
+
+def _format_eta(seconds) -> str:
+    if seconds is None:
+        return "—"
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes}:{secs:02d}"
+
+
+@st.fragment(run_every=1.0)
+def import_job_progress(job_id: str):
+    """Опрашивает таблицу import_jobs раз в секунду, не перерисовывая всю страницу."""
+    job = get_job(job_id)
+    if job is None:
+        return
+    if job.status not in ACTIVE_STATUSES:
+        # Задача закончилась — полный перезапуск покажет итог.
+        st.rerun()
+
+    st.progress(job_fraction(job), text=f"{t('import_progress')} ({t('import_status_' + job.status)})")
+    st.caption(
+        f"{t('import_rows')}: {job.rows_done:,} · "
+        f"{t('import_rate')}: {job.rows_per_sec or 0:,.0f} · "
+        f"{t('import_eta')}: {_format_eta(job.eta_seconds)}"
+    )
+    if st.button(t("import_cancel"), key=f"cancel_{job_id}"):
+        get_import_runner().cancel(job_id)
+        st.toast(t("import_cancel_requested"))
+
+
+def import_job_result(job):
+    """Итог завершённой (или остановленной) задачи импорта."""
+    if job.status == "done":
+        st.success(t("import_success"))
+    elif job.status == "failed":
+        st.error(f"{t('import_status_failed')}: {job.error}")
+    else:
+        st.warning(f"{t('import_status_' + job.status)}: {job.rows_done:,} {t('import_rows').lower()}")
+
+    for line in (job.summary or "").splitlines():
+        st.caption(line)
+    if job.rows_rejected:
+        st.warning(f"{t('import_rejected')}: {job.rows_rejected}")
+    if job.rows_duplicate:
+        st.info(f"{t('import_duplicates')}: {job.rows_duplicate}")
+
+    if job.status in RESUMABLE_STATUSES:
+        if st.button(t("import_resume"), key=f"resume_{job.id}"):
+            get_import_runner().resume(job.id)
+            st.rerun()
 
 
 def debug_db_panel():
@@ -441,11 +541,59 @@ def debug_db_panel():
 
 
 
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+def openai_api_key():
+    """OPENAI_API_KEY из secrets, иначе из окружения; None, если не задан."""
+    try:
+        api_key = st.secrets["OPENAI_API_KEY"]
+    except (KeyError, FileNotFoundError):
+        api_key = getenv("OPENAI_API_KEY")
+    return api_key or None
+
+
+@st.cache_resource
+def get_openai_client():
+    """Клиент OpenAI — один на процесс и только когда он нужен (openai грузится долго).
+    None, если ключ не задан."""
+    api_key = openai_api_key()
+    if api_key is None:
+        return None
+
+    from openai import OpenAI
+
+    return OpenAI(api_key=api_key)
+
+
+@st.cache_resource
+def get_report_batch_runner() -> ReportBatchRunner:
+    """Один исполнитель пакетных отчётов на процесс: пакет переживает закрытие вкладки."""
+    api_key = openai_api_key()
+
+    def client_factory():
+        from openai import AsyncOpenAI
+
+        # Повторы делает generate_reports (с общей паузой на 429), не SDK.
+        return AsyncOpenAI(api_key=api_key, max_retries=0)
+
+    return ReportBatchRunner(client_factory)
+
+
+@st.fragment(run_every=2.0)
+def report_batch_progress(batch_id: str):
+    """Опрашивает object_reports, пока в пакете есть объекты в очереди."""
+    progress = batch_progress(batch_id)
+    if not progress.get("queued"):
+        st.rerun()
+    total = sum(progress.values())
+    finished = progress.get("done", 0) + progress.get("failed", 0)
+    st.progress(finished / total if total else 0.0, text=f"Готово отчётов: {finished} из {total}")
 
 
 
 def page_import():
+    # Исполнитель создаётся до списка задач: при старте он помечает задачи,
+    # которые вёл прошлый процесс, как interrupted — их можно продолжить.
+    runner = get_import_runner()
+
     st.title(t("import_title"))
 
     st.write(t("upload_hint"))
@@ -462,36 +610,53 @@ def page_import():
 
         
         try:
-            objects_df = pd.read_csv(objects_file)
-            diagnostics_df = pd.read_csv(diagnostics_file)
+            st.session_state.import_preview = (
+                read_csv_typed(objects_file, "objects", nrows=5),
+                read_csv_typed(diagnostics_file, "diagnostics", nrows=5),
+            )
         except Exception as e:
             st.error(f"Ошибка при чтении CSV: {e}")
             return
 
-        
-        st.session_state.objects_df = objects_df
-        st.session_state.diagnostics_df = diagnostics_df
-        st.session_state.processed_df = diagnostics_df  
-
        
-        try:
-            import_objects_to_db(objects_df)
-            import_diagnostics_to_db(diagnostics_df)
-        except Exception as e:
-            st.error(f"Ошибка при сохранении в базу данных: {e}")
-            return
-
-
-        st.success(t("import_success"))
+        # Импорт идёт в фоне: вкладку можно закрыть, задача продолжится.
+        st.session_state.import_job = runner.submit(objects_file, diagnostics_file)
+
+    job_id = st.session_state.get("import_job")
+    job = get_job(job_id) if job_id else None
+    if job is not None:
+        if job.status in ACTIVE_STATUSES:
+            import_job_progress(job.id)
+        else:
+            import_job_result(job)
 
+            if job.status == "done" and "import_preview" in st.session_state:
+                objects_head, diagnostics_head = st.session_state.import_preview
+                st.write("Objects (первые 5 строк):")
+                st.dataframe(objects_head)
 
-        st.write("Objects (первые 5 строк):")
-        st.dataframe(objects_df.head())
+                st.write("Diagnostics (первые 5 строк):")
+                st.dataframe(diagnostics_head)
 
-        st.write("Diagnostics (первые 5 строк):")
-        st.dataframe(diagnostics_df.head())
+            debug_db_panel()
 
-        debug_db_panel()
+    
+    # Задачи, прерванные перезапуском или отменённые, можно продолжить.
+    stalled = [j for j in recent_jobs(RESUMABLE_STATUSES) if j.id != job_id]
+    if stalled:
+        st.markdown(f"### {t('import_jobs_resumable')}")
+        for other in stalled:
+            c1, c2 = st.columns([3, 1])
+            with c1:
+                st.write(
+                    f"{other.created_at:%Y-%m-%d %H:%M} · {t('import_status_' + other.status)} · "
+                    f"{other.rows_done:,} {t('import_rows').lower()} · {job_fraction(other):.0%}"
+                )
+            with c2:
+                if st.button(t("import_resume"), key=f"resume_{other.id}"):
+                    runner.resume(other.id)
+                    st.session_state.import_job = other.id
+                    st.rerun()
 
 
 
@@ -501,51 +666,19 @@ def page_map():
     st.title(t("map_title"))
 
     
-    if st.session_state.objects_df is None:
+    lang = st.session_state.get("ui_lang", "ru")
+    options = map_options()
+    if not options["objects"]:
         st.warning(t("import_first"))
         return
-
-    objects_df = st.session_state.objects_df.copy()
-
-    
-    required_cols = {"lat", "lon"}
-    if not required_cols.issubset(objects_df.columns):
+    if not options["total"]:
         st.error(t("no_latlon"))
-        st.dataframe(objects_df.head())
         return
 
-
     
-    if "type" in objects_df.columns:
-        type_col = "type"
-    elif "object_type" in objects_df.columns:
-        type_col = "object_type"
-    else:
-        type_col = None
-
-    
-    if "criticality" in objects_df.columns:
-        crit_col = "criticality"
-    elif "ml_label" in objects_df.columns:
-        crit_col = "ml_label"
-    else:
-        crit_col = None
-
-    
-    lang = st.session_state.get("ui_lang", "ru")
-
-    
-    TYPE_LABELS = {
-        "en": {"Lake": "Lake"},
-        "ru": {"Lake": "Озеро"},
-        "kk": {"Lake": "Көл"},
-    }
-
-    CRIT_LABELS = {
-        "en": {"High": "High", "Medium": "Medium", "Low": "Low"},
-        "ru": {"High": "Высокая", "Medium": "Средняя", "Low": "Низкая"},
-        "kk": {"High": "Жоғары", "Medium": "Орташа", "Low": "Төмен"},
-    }
+    type_col = bool(options["types"])
+    crit_col = bool(options["criticalities"])
+    selected_types, selected_crit, levels = [], [], ()
 
     
     filters_col, map_col = st.columns([1, 3])
@@ -556,275 +689,92 @@ def page_map():
 
         
         if type_col:
-            all_types = sorted(objects_df[type_col].dropna().unique())
-
             def type_format(v: str) -> str:
                 return TYPE_LABELS.get(lang, {}).get(str(v), str(v))
 
             selected_types = st.multiselect(
                 t("object_type"),
-                options=all_types,
-                default=all_types,
+                options=options["types"],
+                default=options["types"],
                 format_func=type_format,
             )
-            if selected_types:
-                objects_df = objects_df[objects_df[type_col].isin(selected_types)]
 
         
         if crit_col:
-            all_crit = sorted(objects_df[crit_col].dropna().unique())
-
             def crit_format(v: str) -> str:
                 return CRIT_LABELS.get(lang, {}).get(str(v), str(v))
 
             selected_crit = st.multiselect(
                 t("criticality"),
-                options=all_crit,
-                default=all_crit,
+                options=options["criticalities"],
+                default=options["criticalities"],
                 format_func=crit_format,
             )
-            if selected_crit:
-                objects_df = objects_df[objects_df[crit_col].isin(selected_crit)]
 
        
         st.markdown(f"**{t('quick_select')}:**")
         c1, c2, c3 = st.columns(3)
         with c1:
             if st.button(t("only_high")) and crit_col:
-                objects_df = objects_df[
-                    objects_df[crit_col].astype(str).str.lower() == "high"
-                ]
+                levels = ("high",)
         with c2:
             if st.button(t("high_medium")) and crit_col:
-                objects_df = objects_df[
-                    objects_df[crit_col].astype(str)
-                    .str.lower()
-                    .isin(["high", "medium"])
-                ]
+                levels = ("high", "medium")
         with c3:
             if st.button(t("all")):
                 
                 pass
 
+        filters = MapFilters(tuple(selected_types), tuple(selected_crit), levels)
+        counts = map_counts(filters)
+
        
-        if objects_df.empty:
+        if not counts["total"]:
             st.warning(t("no_objects_for_filters"))
             return
 
-    
-    with map_col:
-        st.subheader(t("map_subtitle"))
-
-      
-        lat_min, lat_max = float(objects_df["lat"].min()), float(
-            objects_df["lat"].max()
-        )
-        lon_min, lon_max = float(objects_df["lon"].min()), float(
-            objects_df["lon"].max()
-        )
-        lat_range = lat_max - lat_min
-        lon_range = lon_max - lon_min
-        max_range = max(lat_range, lon_range)
-
-        if max_range < 0.1:
-            zoom = 12
-        elif max_range < 1:
-            zoom = 9
-        elif max_range < 10:
-            zoom = 6
-        else:
-            zoom = 4
-
-       
-        def get_color(row):
-            if not crit_col:
-                return [0, 128, 255] 
-            crit = str(row[crit_col]).lower()
-            if "high" in crit:
-                return [255, 0, 0] 
-            elif "medium" in crit:
-                return [255, 165, 0]  
-            elif "low" in crit:
-                return [0, 200, 0] 
-            else:
-                return [100, 149, 237]  
-
-        objects_df["color"] = objects_df.apply(get_color, axis=1)
-
-        midpoint = (
-            float(objects_df["lat"].mean()),
-            float(objects_df["lon"].mean()),
-        )
-
-        viz_df = objects_df.copy()
-
-        
-
-       
-        if lang == "kk" and "name_kk" in viz_df.columns:
-            viz_df["name_ui"] = viz_df["name_kk"]
-        elif lang == "en" and "name_en" in viz_df.columns:
-            viz_df["name_ui"] = viz_df["name_en"]
-        elif "name_ru" in viz_df.columns:
-            viz_df["name_ui"] = viz_df["name_ru"]
-        elif "name" in viz_df.columns:
-            viz_df["name_ui"] = viz_df["name"]
-        else:
-            viz_df["name_ui"] = ""
-
         
-        if lang == "kk" and "oblast_kk" in viz_df.columns:
-            viz_df["region_ui"] = viz_df["oblast_kk"]
-        elif lang == "en" and "oblast_en" in viz_df.columns:
-            viz_df["region_ui"] = viz_df["oblast_en"]
-        elif "oblast_ru" in viz_df.columns:
-            viz_df["region_ui"] = viz_df["oblast_ru"]
-        elif "oblast" in viz_df.columns:
-            viz_df["region_ui"] = viz_df["oblast"]
-        else:
-            viz_df["region_ui"] = ""
-
-       
-        if type_col and type_col in viz_df.columns:
-            def map_type(v):
-                return TYPE_LABELS.get(lang, {}).get(str(v), str(v))
-
-            viz_df["type_ui"] = viz_df[type_col].astype(str).map(map_type)
-        else:
-            viz_df["type_ui"] = ""
-
-       
-        if lang == "kk" and "water_type_kk" in viz_df.columns:
-            viz_df["water_type_ui"] = viz_df["water_type_kk"]
-        elif lang == "en" and "water_type_en" in viz_df.columns:
-            viz_df["water_type_ui"] = viz_df["water_type_en"]
-        elif "water_type_ru" in viz_df.columns:
-            viz_df["water_type_ui"] = viz_df["water_type_ru"]
-        elif "water_type" in viz_df.columns:
-            viz_df["water_type_ui"] = viz_df["water_type"]
-        else:
-            viz_df["water_type_ui"] = ""
-
-        
-        if lang == "kk" and "fauna_kk" in viz_df.columns:
-            viz_df["fauna_ui"] = viz_df["fauna_kk"]
-        elif lang == "en" and "fauna_en" in viz_df.columns:
-            viz_df["fauna_ui"] = viz_df["fauna_en"]
-        elif "fauna_ru" in viz_df.columns:
-            viz_df["fauna_ui"] = viz_df["fauna_ru"]
-        elif "fauna" in viz_df.columns:
-            viz_df["fauna_ui"] = viz_df["fauna"]
-        else:
-            viz_df["fauna_ui"] = ""
-
-       
-        viz_df["passport_date_ui"] = (
-            viz_df["passport_date"] if "passport_date" in viz_df.columns else ""
-        )
-        viz_df["tech_state_ui"] = (
-            viz_df["tech_state"].astype(str)
-            if "tech_state" in viz_df.columns
-            else ""
-        )
+        st.markdown(f"**{t('map_viewport')}:**")
+        mid_lat, mid_lon = options["midpoint"]
+        zoom = st.slider(t("map_zoom"), 1, 18, zoom_for_bounds(options["bounds"]))
+        center_lat = st.number_input(t("map_center_lat"), -90.0, 90.0, float(mid_lat), format="%.4f")
+        center_lon = st.number_input(t("map_center_lon"), -180.0, 180.0, float(mid_lon), format="%.4f")
 
     
-        for src, dst in [
-            ("coords_center", "coords_center_ui"),
-            ("coords_north", "coords_north_ui"),
-            ("coords_south", "coords_south_ui"),
-            ("coords_east", "coords_east_ui"),
-            ("coords_west", "coords_west_ui"),
-        ]:
-            if src in viz_df.columns:
-                viz_df[dst] = viz_df[src]
-            else:
-                viz_df[dst] = ""
-
-        
-        if crit_col:
-            def map_crit(v):
-                return CRIT_LABELS.get(lang, {}).get(str(v), str(v))
-
-            viz_df["crit_ui"] = viz_df[crit_col].astype(str).map(map_crit)
-        else:
-            viz_df["crit_ui"] = ""
+    with map_col:
+        st.subheader(t("map_subtitle"))
 
         
-        if "object_id" not in viz_df.columns:
-            viz_df["object_id"] = range(1, len(viz_df) + 1)
+        bbox = viewport_bbox(center_lat, center_lon, zoom, MAP_WIDTH_PX, MAP_HEIGHT_PX)
+        in_view = map_counts(filters, bbox)["total"]
+        clustered = in_view > MAP_MAX_POINTS
 
-       
-        if lang == "kk":
-            type_label = "Объект түрі"
-            crit_label = "Критикалылық"
-            id_label = "ID"
-            region_label = "Облыс"
-            water_type_label = "Су түрі"
-            fauna_label = "Фауна"
-            passport_label = "Паспорт күні"
-            tech_label = "Тех. жағдай"
-            coords_label = "Координаттар"
-            center_label = "Ортасы"
-            north_label = "Солтүстік"
-            south_label = "Оңтүстік"
-            east_label = "Шығыс"
-            west_label = "Батыс"
-        elif lang == "en":
-            type_label = "Type"
-            crit_label = "Criticality"
-            id_label = "ID"
-            region_label = "Region"
-            water_type_label = "Water type"
-            fauna_label = "Fauna"
-            passport_label = "Passport date"
-            tech_label = "Tech state"
-            coords_label = "Coordinates"
-            center_label = "Center"
-            north_label = "North"
-            south_label = "South"
-            east_label = "East"
-            west_label = "West"
-        else:  
-            type_label = "Тип объекта"
-            crit_label = "Критичность"
-            id_label = "ID"
-            region_label = "Область"
-            water_type_label = "Тип воды"
-            fauna_label = "Фауна"
-            passport_label = "Дата паспорта"
-            tech_label = "Тех. состояние"
-            coords_label = "Координаты"
-            center_label = "Центр"
-            north_label = "Север"
-            south_label = "Юг"
-            east_label = "Восток"
-            west_label = "Запад"
+        labels = TOOLTIP_LABELS.get(lang, TOOLTIP_LABELS["ru"])
 
-        
         tooltip_html = f"""
         <div style="font-family: Arial, sans-serif; font-size: 12px; padding: 8px 10px;">
           <div style="font-weight: 600; font-size: 13px; margin-bottom: 6px;">{{name_ui}}</div>
 
-          <div><b>{region_label}:</b> {{region_ui}}</div>
-          <div><b>{type_label}:</b> {{type_ui}}</div>
-          <div><b>{water_type_label}:</b> {{water_type_ui}}</div>
-          <div><b>{fauna_label}:</b> {{fauna_ui}}</div>
-          <div><b>{passport_label}:</b> {{passport_date_ui}}</div>
-          <div><b>{tech_label}:</b> {{tech_state_ui}}</div>
+          <div><b>{labels['region']}:</b> {{region_ui}}</div>
+          <div><b>{labels['type']}:</b> {{type_ui}}</div>
+          <div><b>{labels['water_type']}:</b> {{water_type_ui}}</div>
+          <div><b>{labels['fauna']}:</b> {{fauna_ui}}</div>
+          <div><b>{labels['passport']}:</b> {{passport_date_ui}}</div>
+          <div><b>{labels['tech']}:</b> {{tech_state_ui}}</div>
 
           <hr style="border: 0; border-top: 1px solid #374151; margin: 6px 0;" />
 
-          <div style="margin-bottom: 2px;"><b>{coords_label}:</b></div>
-          <div>{center_label}: {{coords_center_ui}}</div>
-          <div>{north_label}: {{coords_north_ui}}</div>
-          <div>{south_label}: {{coords_south_ui}}</div>
-          <div>{east_label}: {{coords_east_ui}}</div>
-          <div>{west_label}: {{coords_west_ui}}</div>
+          <div style="margin-bottom: 2px;"><b>{labels['coords']}:</b></div>
+          <div>{labels['center']}: {{coords_center_ui}}</div>
+          <div>{labels['north']}: {{coords_north_ui}}</div>
+          <div>{labels['south']}: {{coords_south_ui}}</div>
+          <div>{labels['east']}: {{coords_east_ui}}</div>
+          <div>{labels['west']}: {{coords_west_ui}}</div>
 
           <hr style="border: 0; border-top: 1px solid #374151; margin: 6px 0;" />
 
-          <div><b>{id_label}:</b> {{object_id}}</div>
-          <div><b>{crit_label}:</b> {{crit_ui}}</div>
+          <div><b>ID:</b> {{object_id}}</div>
+          <div><b>{labels['crit']}:</b> {{crit_ui}}</div>
         </div>
         """
 
@@ -836,64 +786,106 @@ def page_map():
             max_zoom=22,
             tile_size=256,
         )
-
-        layer = pdk.Layer(
-            "ScatterplotLayer",
-            data=viz_df,
-            get_position="[lon, lat]",
-            get_fill_color="color",
-            get_radius=80,
-            pickable=True,
+        view_state = pdk.ViewState(
+            latitude=center_lat,
+            longitude=center_lon,
+            zoom=zoom,
+            pitch=0,
         )
+        tooltip_style = {"backgroundColor": "#111827", "color": "white"}
 
-        deck = pdk.Deck(
-            layers=[tile_layer, layer],
-            initial_view_state=pdk.ViewState(
-                latitude=midpoint[0],
-                longitude=midpoint[1],
-                zoom=zoom,
-                pitch=0,
-            ),
-            map_style=None,
-            tooltip={"html": tooltip_html, "style": {"backgroundColor": "#111827", "color": "white"}},
-        )
+        if clustered:
+            
+            clusters = cluster_layer_data(
+                load_clusters(filters, bbox, CLUSTER_CELL_PX * degrees_per_pixel(zoom))
+            )
+            layer = pdk.Layer(
+                "ScatterplotLayer",
+                id="clusters",
+                data=clusters,
+                get_position="[lon, lat]",
+                get_fill_color="[r, g, b, 200]",
+                get_radius="radius",
+                radius_units="pixels",
+                pickable=True,
+            )
+            deck = pdk.Deck(
+                layers=[tile_layer, layer],
+                initial_view_state=view_state,
+                map_style=None,
+                tooltip={
+                    "html": f"<b>{t('objects_metric')}:</b> {{count}}<br>"
+                            "High: {high} · Medium: {medium} · Low: {low}",
+                    "style": tooltip_style,
+                },
+            )
+            st.pydeck_chart(deck, use_container_width=True, height=MAP_HEIGHT_PX)
+            st.caption(t("map_clustered").format(count=in_view))
+        else:
+            viz_df = load_viewport_objects(
+                filters, bbox, lang, TYPE_LABELS, CRIT_LABELS, MAP_MAX_POINTS
+            )
+            compact = st.toggle(t("map_compact"), value=True, help=t("map_compact_help"))
+
+            layer = pdk.Layer(
+                "ScatterplotLayer",
+                id="objects",
+                data=compact_layer_data(viz_df) if compact else viz_df[MAP_LAYER_COLUMNS],
+                get_position="[lon, lat]",
+                get_fill_color="[r, g, b]",
+                get_radius=80,
+                pickable=True,
+            )
 
-        st.pydeck_chart(deck, use_container_width=True)
+            deck = pdk.Deck(
+                layers=[tile_layer, layer],
+                initial_view_state=view_state,
+                map_style=None,
+                tooltip={
+                    # В компактном режиме в браузер уходит только ID, остальное — по клику.
+                    "html": "<b>ID:</b> {object_id}" if compact else tooltip_html,
+                    "style": tooltip_style,
+                },
+            )
 
-        
-        st.subheader(t("table_title"))
-        st.dataframe(
-            objects_df.drop(columns=["color"], errors="ignore"),
-            use_container_width=True,
-        )
+            if compact:
+                event = st.pydeck_chart(
+                    deck,
+                    use_container_width=True,
+                    height=MAP_HEIGHT_PX,
+                    on_select="rerun",
+                    selection_mode="single-object",
+                    key="objects_map",
+                )
+                picked = event.selection.get("objects", {}).get("objects", [])
+                if picked:
+                    details = viz_df[viz_df["object_id"] == picked[0]["object_id"]]
+                    if not details.empty:
+                        st.markdown(
+                            render_tooltip(tooltip_html, details.iloc[0]),
+                            unsafe_allow_html=True,
+                        )
+                else:
+                    st.caption(t("map_pick_hint"))
+            else:
+                st.pydeck_chart(deck, use_container_width=True, height=MAP_HEIGHT_PX)
+
+            
+            st.subheader(t("table_title"))
+            st.dataframe(
+                viz_df[OBJECT_TABLE_COLUMNS],
+                use_container_width=True,
+            )
 
         st.markdown(f"### {t('summary_title')}")
         c1, c2, c3 = st.columns(3)
         with c1:
-            st.metric(t("objects_metric"), len(objects_df))
+            st.metric(t("objects_metric"), counts["total"])
         if crit_col:
             with c2:
-                st.metric(
-                    t("high_metric"),
-                    int(
-                        objects_df[crit_col]
-                        .astype(str)
-                        .str.lower()
-                        .eq("high")
-                        .sum()
-                    ),
-                )
+                st.metric(t("high_metric"), counts["high"])
             with c3:
-                st.metric(
-                    t("medium_metric"),
-                    int(
-                        objects_df[crit_col]
-                        .astype(str)
-                        .str.lower()
-                        .eq("medium")
-                        .sum()
-                    ),
-                )
+                st.metric(t("medium_metric"), counts["medium"])
 
 
 
@@ -911,92 +903,73 @@ def _crit_format(value: str) -> str:
 def page_defects():
     st.title(t("defects_title"))
 
-    if st.session_state.diagnostics_df is None:
+    options = diagnostics_options()
+    if options["min_date"] is None:
         st.warning(t("import_first"))
         return
 
-    diagnostics_df = st.session_state.diagnostics_df.copy()
-
     st.subheader(t("filters_title"))
 
     
-    if "method" in diagnostics_df.columns:
-        all_methods = sorted(diagnostics_df["method"].dropna().unique())
-        selected_methods = st.multiselect(
-            t("defects_method"),
-            options=all_methods,
-            default=all_methods,
-        )
-        if selected_methods:
-            diagnostics_df = diagnostics_df[
-                diagnostics_df["method"].isin(selected_methods)
-            ]
+    selected_methods = st.multiselect(
+        t("defects_method"),
+        options=options["methods"],
+        default=options["methods"],
+    )
 
     
-    crit_col = None
-    if "criticality" in diagnostics_df.columns:
-        crit_col = "criticality"
-    elif "severity" in diagnostics_df.columns:
-        crit_col = "severity"
-
-    if crit_col is not None:
-        all_crit = sorted(diagnostics_df[crit_col].dropna().unique())
-        selected_crit = st.multiselect(
-            t("defects_crit"),
-            options=all_crit,
-            default=all_crit,
-            format_func=_crit_format,
-        )
-        if selected_crit:
-            diagnostics_df = diagnostics_df[
-                diagnostics_df[crit_col].isin(selected_crit)
-            ]
+    selected_crit = st.multiselect(
+        t("defects_crit"),
+        options=options["severities"],
+        default=options["severities"],
+        format_func=_crit_format,
+    )
 
     
-    if "date" in diagnostics_df.columns:
-        diagnostics_df["date_parsed"] = pd.to_datetime(
-            diagnostics_df["date"], errors="coerce"
-        )
-        min_date = diagnostics_df["date_parsed"].min()
-        max_date = diagnostics_df["date_parsed"].max()
+    date_range = st.date_input(
+        t("defects_date_range"),
+        value=(options["min_date"], options["max_date"]),
+    )
+    start_date, end_date = (
+        date_range if len(date_range) == 2 else (options["min_date"], options["max_date"])
+    )
 
-        if pd.notnull(min_date) and pd.notnull(max_date):
-            start_date, end_date = st.date_input(
-                t("defects_date_range"),
-                value=(min_date.date(), max_date.date()),
-            )
-            if start_date and end_date:
-                mask = (
-                    diagnostics_df["date_parsed"].dt.date >= start_date
-                ) & (diagnostics_df["date_parsed"].dt.date <= end_date)
-                diagnostics_df = diagnostics_df[mask]
+    filters = KpiFilters(
+        methods=tuple(selected_methods),
+        severities=tuple(selected_crit),
+        date_from=start_date,
+        date_to=end_date,
+    )
+    kpis = compute_kpis(filters)
 
     st.markdown("---")
 
-    if diagnostics_df.empty:
+    if not kpis["total_inspections"]:
         st.warning(t("defects_no_records"))
         return
 
    
     st.subheader(t("defects_table"))
-    cols_to_show = [
-        c for c in diagnostics_df.columns if c not in ["date_parsed"]
-    ]
-    st.dataframe(diagnostics_df[cols_to_show].head(300), use_container_width=True)
+    st.dataframe(
+        load_diagnostics(
+            filters.methods, filters.severities, filters.date_from, filters.date_to, limit=300
+        ),
+        use_container_width=True,
+    )
 
     
     st.subheader(t("defects_summary"))
-    st.write(f"{t('defects_count')}: {len(diagnostics_df)}")
-
-    if crit_col is not None:
-        st.write(t("defects_crit_dist") + ":")
-        counts = diagnostics_df[crit_col].value_counts().reset_index()
-        counts.columns = ["_crit_raw", "count"]
-        counts[t("criticality")] = counts["_crit_raw"].apply(_crit_format)
-        st.dataframe(
-            counts[[t("criticality"), "count"]],
-            use_container_width=True,
-        )
+    st.write(f"{t('defects_count')}: {kpis['total_inspections']}")
+
+    st.write(t("defects_crit_dist") + ":")
+    counts = pd.DataFrame(
+        list(kpis["severity_counts"].items()), columns=["_crit_raw", "count"]
+    )
+    counts[t("criticality")] = counts["_crit_raw"].apply(_crit_format)
+    st.dataframe(
+        counts[[t("criticality"), "count"]],
+        use_container_width=True,
+    )
 
 
 def page_history():
@@ -1075,71 +1048,33 @@ def page_history():
 
 
 def page_dashboard():
-    st.title(t("dashboard_title"))
+    import plotly.express as px
 
-    if (
-        "diagnostics_df" not in st.session_state
-        or "objects_df" not in st.session_state
-    ):
-        st.warning(t("import_first"))
-        return
+    st.title(t("dashboard_title"))
 
-    diagnostics = st.session_state["diagnostics_df"].copy()
-    objects = st.session_state["objects_df"].copy()
+    kpis = compute_kpis()
 
-    if diagnostics.empty or objects.empty:
-        st.warning(t("no_objects_for_filters"))
+    if not kpis["total_inspections"] or not kpis["total_objects"]:
+        st.warning(t("import_first"))
         return
 
-    
-    if "date" in diagnostics.columns:
-        diagnostics["date"] = pd.to_datetime(
-            diagnostics["date"], errors="coerce"
-        )
-        diagnostics["year"] = diagnostics["date"].dt.year
-    else:
-        diagnostics["year"] = None
-
-    
-    if "severity" in diagnostics.columns:
-        diagnostics["severity"] = (
-            diagnostics["severity"].astype(str).str.lower()
-        )
-    elif "criticality" in diagnostics.columns:
-        diagnostics["severity"] = (
-            diagnostics["criticality"].astype(str).str.lower()
-        )
-    else:
-        diagnostics["severity"] = "unknown"
-
-    if "defect_found" not in diagnostics.columns:
-        diagnostics["defect_found"] = diagnostics["severity"].apply(
-            lambda x: 0 if x == "low" else 1
-        )
-
     st.markdown("## " + t("dashboard_kpi_title"))
 
     col1, col2, col3, col4 = st.columns(4)
-    total_inspections = len(diagnostics)
-    total_objects = objects["object_id"].nunique()
-    total_defects = int(diagnostics["defect_found"].sum())
-    total_high = (diagnostics["severity"] == "high").sum()
-
-    col1.metric(t("dashboard_kpi_inspections"), total_inspections)
-    col2.metric(t("dashboard_kpi_objects"), total_objects)
-    col3.metric(t("dashboard_kpi_defects"), total_defects)
-    col4.metric(t("dashboard_kpi_high"), total_high)
+    col1.metric(t("dashboard_kpi_inspections"), kpis["total_inspections"])
+    col2.metric(t("dashboard_kpi_objects"), kpis["total_objects"])
+    col3.metric(t("dashboard_kpi_defects"), kpis["total_defects"])
+    col4.metric(t("dashboard_kpi_high"), kpis["total_high"])
 
     st.markdown("---")
 
     
     st.subheader(t("dashboard_crit_title"))
 
-    if diagnostics["severity"].notna().any():
-        crit_counts = (
-            diagnostics["severity"].value_counts().reset_index()
+    if kpis["severity_counts"]:
+        crit_counts = pd.DataFrame(
+            list(kpis["severity_counts"].items()), columns=["severity_raw", "count"]
         )
-        crit_counts.columns = ["severity_raw", "count"]
         crit_counts["severity_ui"] = crit_counts["severity_raw"].apply(
             _crit_format
         )
@@ -1162,188 +1097,114 @@ def page_report():
     st.title("GPT-Отчёт по результатам диагностики")
 
     
-    if "diagnostics_df" not in st.session_state or "objects_df" not in st.session_state:
-        st.warning("Сначала загрузите данные на странице «Импорт данных».")
-        return
-
-    
-    objects = st.session_state["objects_df"].copy()
-    diagnostics = st.session_state["diagnostics_df"].copy()
+    kpis = compute_kpis()
 
-    if diagnostics.empty or objects.empty:
-        st.warning("Таблицы пустые. Загрузите корректные CSV.")
+    if not kpis["total_inspections"] or not kpis["total_objects"]:
+        st.warning("Сначала загрузите данные на странице «Импорт данных».")
         return
 
-   
-
-    
-    if "date" in diagnostics.columns:
-        diagnostics["date"] = pd.to_datetime(diagnostics["date"], errors="coerce")
-        diagnostics["year"] = diagnostics["date"].dt.year
-    else:
-        diagnostics["year"] = None
-
-   
-    if "defect_found" not in diagnostics.columns:
-        if "severity" in diagnostics.columns:
-            diagnostics["defect_found"] = diagnostics["severity"].apply(
-                lambda x: 1 if str(x).lower() != "low" else 0
-            )
-        else:
-            diagnostics["defect_found"] = 0
-
-    
-    if "ml_label" not in diagnostics.columns:
-        if "severity" in diagnostics.columns:
-            diagnostics["ml_label"] = diagnostics["severity"].astype(str).str.lower()
-        else:
-            diagnostics["ml_label"] = "unknown"
-
-
-    total_inspections = len(diagnostics)
-    total_objects = objects["object_id"].nunique() if "object_id" in objects.columns else 0
-    total_defects = int(diagnostics["defect_found"].sum())
-
-    
-    if "method" in diagnostics.columns:
-        method_stats = (
-            diagnostics[diagnostics["defect_found"] == 1]
-            .groupby("method")["defect_found"]
-            .sum()
-            .sort_values(ascending=False)
-            .to_dict()
-        )
-    else:
-        method_stats = {}
-
-    
-    if "ml_label" in diagnostics.columns:
-        crit_stats = diagnostics["ml_label"].value_counts().to_dict()
-    else:
-        crit_stats = {}
-
-    
-    if "year" in diagnostics.columns and diagnostics["year"].notna().any():
-        year_stats = (
-            diagnostics.dropna(subset=["year"])
-            .groupby("year")["object_id"]
-            .count()
-            .sort_index()
-            .to_dict()
-        )
-    else:
-        year_stats = {}
-
-   
-    if "object_id" in diagnostics.columns:
-        top_objects_series = (
-            diagnostics[diagnostics["defect_found"] == 1]
-            .groupby("object_id")["defect_found"]
-            .sum()
-            .sort_values(ascending=False)
-            .head(5)
-        )
-        top_objects = top_objects_series.to_dict()
-    else:
-        top_objects = {}
+    inputs = report_inputs(kpis)
 
    
     st.subheader("Сводная информация (данные дашборда)")
-    st.write("Обследований:", total_inspections)
-    st.write("Объектов:", total_objects)
-    st.write("Дефектов:", total_defects)
-    st.write("Методы (дефекты по методам):", method_stats)
-    st.write("Распределение по критичности:", crit_stats)
-    st.write("Динамика по годам:", year_stats)
-    st.write("Топ проблемных объектов:", top_objects)
+    st.write("Обследований:", inputs["total_inspections"])
+    st.write("Объектов:", inputs["total_objects"])
+    st.write("Дефектов:", inputs["total_defects"])
+    st.write("Методы (дефекты по методам):", inputs["method_stats"])
+    st.write("Распределение по критичности:", inputs["crit_stats"])
+    st.write("Динамика по годам:", inputs["year_stats"])
+    st.write("Топ проблемных объектов:", inputs["top_objects"])
+
+    regenerate = st.checkbox("Сгенерировать заново (не брать из кэша)")
 
     
     if st.button("Сформировать отчёт"):
-        with st.spinner("Генерация полного инженерного отчёта..."):
-
-            prompt = f"""
-Ты — инженер по промышленной безопасности. 
-Ниже данные технического дашборда IntegrityOS, который анализирует объекты инфраструктуры.
-
-Проанализируй эти данные как эксперт и составь:
-
-1) Общую оценку ситуации  
-2) Краткий анализ дефектов  
-3) Какие методы контроля наиболее эффективны  
-4) Какие объекты наиболее проблемные и почему  
-5) Что нужно сделать в первую очередь (приоритетный план работы)  
-6) Риски, если ничего не делать  
-7) Профессиональные рекомендации инженера  
-
-ДАННЫЕ ДАШБОРДА:
-
-
-- Всего обследований: {total_inspections}
-- Всего объектов: {total_objects}
-- Количество дефектов: {total_defects}
-
-Методы контроля (дефекты):
-{method_stats}
-
-Распределение по критичности:
-{crit_stats}
-
-Динамика по годам:
-{year_stats}
-
-Топ проблемных объектов (object_id → количество дефектов):
-{top_objects}
-
-Проанализируй эти данные и сформируй профессиональный технический отчёт. 
-Не выдумывай данные — анализируй только то, что дано.
-"""
-
-            client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-            response = client.responses.create(
-                model="gpt-4.1-mini",
-                input=prompt,
+        st.subheader("Готовый GPT-Отчёт")
+        status = st.empty()
+        body = st.empty()
+        builder = ReportBuilder()
+        usage = ReportUsage()
+
+        def generate(prompt):
+            # Текст выводится по мере генерации; перерисовываем на границе
+            # абзаца или раз в REPORT_REFRESH_SEC, а не на каждый токен.
+            client = get_openai_client()
+            if client is None:
+                raise RuntimeError("OPENAI_API_KEY не задан: новый отчёт сформировать нельзя.")
+            status.caption("Генерация полного инженерного отчёта...")
+            shown = 0.0
+            for delta in stream_report(client, prompt, usage=usage):
+                new_section = builder.feed(delta)
+                if new_section or time.monotonic() - shown > REPORT_REFRESH_SEC:
+                    body.markdown(builder.text + " ▌")
+                    shown = time.monotonic()
+            status.empty()
+            return builder.text
+
+        # Те же данные, модель и язык — готовый отчёт из кэша без запроса к GPT.
+        try:
+            report, from_cache = cached_report(
+                inputs, st.session_state.ui_lang, generate, force=regenerate, usage=usage
             )
-
-            report = response.output_text
-
-           
-            st.subheader("Готовый GPT-Отчёт")
-            st.markdown(report)
-
-            html_text = report.strip()
-            html_text = html_text.replace("\n\n", "</p><p>")
-            html_text = html_text.replace("\n", "<br>")
-
-            html_report = f"""
-<html>
-<head>
-    <meta charset="utf-8">
-    <title>IntegrityOS – GPT-отчёт</title>
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            margin: 30px;
-            line-height: 1.6;
-            font-size: 16px;
-        }}
-        p {{
-            margin-bottom: 15px;
-        }}
-    </style>
-</head>
-<body>
-<p>{html_text}</p>
-</body>
-</html>
-"""
+        except RuntimeError as e:
+            status.empty()
+            st.error(str(e))
+        else:
+            if from_cache:
+                status.caption("Отчёт взят из кэша: данные дашборда не изменились.")
+                builder = ReportBuilder()
+                builder.feed(report)
+            else:
+                status.caption(f"Отчёт сформирован: {usage}")
+            body.markdown(report)
 
             st.download_button(
                 "Скачать отчёт (HTML)",
-                html_report,
+                builder.html(),
                 "integrity_gpt_report.html",
                 "text/html"
             )
 
+    st.divider()
+    st.subheader("Отчёты по объектам")
+    source = st.radio(
+        "Объекты",
+        ["top", "high"],
+        format_func={"top": "Топ по числу дефектов", "high": "Все объекты с High-диагностикой"}.get,
+        horizontal=True,
+    )
+    limit = st.number_input("Сколько объектов", 1, 1000, 20) if source == "top" else 0
+
+    if st.button("Сформировать отчёты по объектам"):
+        object_ids = risk_objects(source, limit)
+        if openai_api_key() is None:
+            st.error("OPENAI_API_KEY не задан: новый отчёт сформировать нельзя.")
+        elif not object_ids:
+            st.info("Подходящих объектов нет.")
+        else:
+            st.session_state.report_batch = get_report_batch_runner().submit(
+                object_ids, st.session_state.ui_lang
+            )
+
+    batch_id = st.session_state.get("report_batch")
+    if batch_id:
+        progress = batch_progress(batch_id)
+        if progress.get("queued"):
+            report_batch_progress(batch_id)
+        else:
+            totals = batch_usage(batch_id)
+            st.caption(
+                f"Готово: {progress.get('done', 0)}, с ошибкой: {progress.get('failed', 0)}; "
+                f"токены: вход {totals['input_tokens']:,}, выход {totals['output_tokens']:,}; "
+                f"в среднем {totals['seconds']:.1f} с на отчёт"
+            )
+            st.download_button(
+                "Скачать отчёты по объектам (ZIP)",
+                batch_archive(batch_id),
+                f"integrity_object_reports_{batch_id[:8]}.zip",
+                "application/zip",
+            )
+
 
 
 st.sidebar.title("IntegrityOS – Demo")
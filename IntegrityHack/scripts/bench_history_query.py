@@ -0,0 +1,134 @@
+"""Бенчмарк запроса истории объекта (page_history) на большой таблице inspections.
+
+Запуск из каталога IntegrityHack:
+
+    python scripts/bench_history_query.py --rows 10000000 --objects 100000
+
+Генерирует временную SQLite-базу по моделям utils/db.py, выполняет
+миграцию индексов и замеряет WHERE object_id = ? ORDER BY date DESC
+на случайных объектах. --no-index — тот же замер без индексов для сравнения.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import bindparam, create_engine, select, text  # noqa: E402
+
+from utils.db import Base, Inspection, migrate  # noqa: E402
+
+
+METHODS = ["UT", "MT", "VT", "RT", "PT"]
+LABELS = ["low", "medium", "high"]
+
+
+def fill(engine, rows: int, objects: int, batch: int = 200_000):
+    start_day = date(2015, 1, 1).toordinal()
+    rnd = random.Random(42)
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.executemany(
+            "INSERT INTO objects (id, object_name, object_type) VALUES (?, ?, ?)",
+            ((i, f"obj-{i}", "Pipeline") for i in range(1, objects + 1)),
+        )
+        for offset in range(0, rows, batch):
+            n = min(batch, rows - offset)
+            cur.executemany(
+                "INSERT INTO inspections (id, object_id, date, method, defect_found, ml_label) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        offset + i + 1,
+                        rnd.randint(1, objects),
+                        date.fromordinal(start_day + rnd.randint(0, 3650)).isoformat(),
+                        rnd.choice(METHODS),
+                        rnd.random() < 0.6,
+                        rnd.choice(LABELS),
+                    )
+                    for i in range(n)
+                ),
+            )
+            raw.commit()
+            print(f"  {offset + n:,} / {rows:,}", end="\r", flush=True)
+        print()
+    finally:
+        raw.close()
+
+
+def bench(engine, objects: int, repeats: int):
+    query = (
+        select(Inspection)
+        .where(Inspection.object_id == 0)
+        .order_by(Inspection.date.desc())
+    )
+    compiled = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+
+    with engine.connect() as conn:
+        plan = conn.execute(text("EXPLAIN QUERY PLAN " + compiled)).fetchall()
+        print("Query plan:")
+        for row in plan:
+            print("  ", row[-1])
+
+        stmt = (
+            select(Inspection)
+            .where(Inspection.object_id == bindparam("oid"))
+            .order_by(Inspection.date.desc())
+        )
+        rnd = random.Random(7)
+        timings = []
+        returned = 0
+        for _ in range(repeats):
+            oid = rnd.randint(1, objects)
+            started = time.perf_counter()
+            result = conn.execute(stmt, {"oid": oid}).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+            returned += len(result)
+
+    timings.sort()
+    print(f"Rows per object (avg): {returned / repeats:.1f}")
+    print(f"median: {statistics.median(timings):.3f} ms")
+    print(f"p95:    {timings[int(len(timings) * 0.95) - 1]:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--objects", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=1000)
+    parser.add_argument("--no-index", action="store_true")
+    parser.add_argument("--db", help="путь к SQLite-файлу (по умолчанию временный)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    fresh = not os.path.exists(path)
+
+    if fresh:
+        # Таблицы без индексов: заливка быстрее, индексы строим одним проходом.
+        for table in Base.metadata.sorted_tables:
+            table.create(engine, checkfirst=True)
+            for index in list(table.indexes):
+                index.drop(engine, checkfirst=True)
+        print(f"Filling {args.rows:,} inspections into {path}")
+        started = time.perf_counter()
+        fill(engine, args.rows, args.objects)
+        print(f"Filled in {time.perf_counter() - started:.1f} s")
+
+    if not args.no_index:
+        started = time.perf_counter()
+        migrate(engine)
+        print(f"Indexes ready in {time.perf_counter() - started:.1f} s")
+
+    bench(engine, args.objects, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Бенчмарк холодного старта app.py: время первой отрисовки и загруженные тяжёлые модули.
+
+Запуск из каталога IntegrityHack:
+
+    python scripts/bench_startup.py --runs 5
+
+Каждый замер — новый процесс Python (холодный импорт). Скрипт приложения
+прогоняется через streamlit.testing (AppTest) на временной копии базы:
+сначала стартовая страница, затем выбранная в меню. Для каждой страницы
+печатаются медианы времени и список тяжёлых библиотек, которые оказались
+загружены, — openai, plotly и pydeck должны появляться только на своих
+страницах. --app — другой app.py для сравнения (например, из git worktree).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = ["menu_import", "menu_map", "menu_defects", "menu_history", "menu_dashboard", "menu_report"]
+# plotly (без express) и pyarrow тянут сами streamlit и pandas — их не считаем.
+HEAVY_MODULES = ["openai", "plotly.express", "pydeck", "sklearn"]
+
+# Выполняется в дочернем процессе: argv — app.py, страница, ключ OpenAI ("" — без secrets).
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+loaded = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+if sys.argv[3]:
+    at.secrets["OPENAI_API_KEY"] = sys.argv[3]
+at.run()
+first = time.perf_counter()
+if sys.argv[2] != "menu_import" and not at.exception:
+    at.sidebar.radio[0].set_value(sys.argv[2]).run()
+page = time.perf_counter()
+print(json.dumps({
+    "streamlit": loaded - started,
+    "first_render": first - loaded,
+    "page_render": page - first,
+    "errors": [str(e.value) for e in at.exception],
+    "modules": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(app: str, page: str, db: str, secret: str) -> dict:
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db}", PYTHONDONTWRITEBYTECODE="1")
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, app, page, secret],
+        cwd=os.path.dirname(app),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"))
+    parser.add_argument("--pages", nargs="*", default=PAGES)
+    parser.add_argument(
+        "--secret", action="store_true",
+        help="передать OPENAI_API_KEY через st.secrets (фиктивный ключ, запросов к API нет)",
+    )
+    args = parser.parse_args()
+
+    db = os.path.join(tempfile.mkdtemp(), "bench.db")
+    app = os.path.abspath(args.app)
+    secret = "sk-bench" if args.secret else ""
+    print(f"app: {app}\nruns per page: {args.runs}\n")
+    print(f"{'page':<16}{'first render':>14}{'page render':>13}  heavy modules loaded")
+    for page in args.pages:
+        samples = [measure(app, page, db, secret) for _ in range(args.runs)]
+        first = statistics.median(s["first_render"] for s in samples)
+        render = statistics.median(s["page_render"] for s in samples)
+        modules = ", ".join(samples[-1]["modules"]) or "—"
+        errors = samples[-1]["errors"]
+        print(f"{page:<16}{first:>12.2f} s{render:>11.2f} s  {modules}")
+        if errors:
+            print(f"  ошибка: {errors[0].splitlines()[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+# tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+# utils.db создаёт движок при импорте — база тестов должна быть задана раньше.
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from sqlalchemy import delete  # noqa: E402
+
+
+@pytest.fixture
+def empty_db():
+    """Пустые таблицы данных (объекты, осмотры, дефекты, старые ключи, сводки, версия данных)."""
+    from utils.db import (
+        init_db, write_session, DATA_VERSION_KEY,
+        Meta, Defect, Inspection, Object, LegacyInspection, ObjectMonthRollup, MethodYearRollup,
+    )
+
+    init_db()
+    with write_session() as session:
+        for model in (Defect, Inspection, Object, LegacyInspection, ObjectMonthRollup, MethodYearRollup):
+            session.execute(delete(model))
+        session.execute(delete(Meta).where(Meta.key == DATA_VERSION_KEY))
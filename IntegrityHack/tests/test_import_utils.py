@@ -0,0 +1,199 @@
+# tests/test_import_utils.py
+#
+# Естественные ключи диагностик: повторный импорт и обновление старой базы.
+
+import pandas as pd
+import pytest
+from sqlalchemy import delete, func, select, update
+
+from utils.db import (
+    write_engine, write_session, migrate, rebuild_rollups, LEGACY_IDS_KEY,
+    Meta, Inspection, Defect, LegacyInspection, MethodYearRollup,
+)
+from utils.import_utils import (
+    import_diagnostics_csv, import_diagnostics_parallel, import_objects, inspection_natural_ids, read_csv_typed,
+)
+
+
+OBJECTS = pd.DataFrame(
+    {"object_id": [1, 2, 3], "object_name": ["A", "B", "C"], "lat": [50.0, 51.0, 52.0], "lon": [70.0, 71.0, 72.0]}
+)
+
+# Файл без diag_id: ключ — хэш (object_id, date, method, описание).
+PLAIN_CSV = """object_id,date,method,severity,description
+1,2023-04-01,UT,high,трещина
+1,2023-05-01,VT,low,
+2,12.06.2024,MT,medium,коррозия
+3,2024-07-15,UT,low,норма
+"""
+
+# Файл с явными diag_id (как анкеты бота).
+EXPLICIT_CSV = """diag_id,object_id,date,method,severity,description
+1001,2,2022-01-10,UT,high,вмятина
+1002,3,2022-02-11,VT,low,
+1003,3,2022-03-12,MT,medium,риска
+"""
+
+
+def write_csv(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def counts():
+    with write_engine.connect() as conn:
+        return (
+            conn.execute(select(func.count()).select_from(Inspection)).scalar(),
+            conn.execute(select(func.count()).select_from(Defect)).scalar(),
+            conn.execute(select(func.sum(MethodYearRollup.inspections))).scalar(),
+        )
+
+
+def stored_ids() -> pd.DataFrame:
+    with write_engine.connect() as conn:
+        return pd.read_sql(
+            select(Inspection.id, Inspection.object_id, Inspection.date, Inspection.method, Inspection.defect_descr)
+            .order_by(Inspection.date),
+            conn,
+        )
+
+
+@pytest.fixture
+def files(empty_db, tmp_path):
+    import_objects(OBJECTS)
+    return write_csv(tmp_path, "plain.csv", PLAIN_CSV), write_csv(tmp_path, "explicit.csv", EXPLICIT_CSV)
+
+
+def test_natural_ids_of_stored_rows_match_import(files):
+    plain, _ = files
+    import_diagnostics_csv(plain)
+
+    rows = stored_ids()
+    assert len(rows) == 4
+    assert rows["id"].tolist() == inspection_natural_ids(rows).tolist()
+    assert (rows["id"] > 2**31).all()
+
+
+def test_reimport_is_idempotent(files):
+    plain, explicit = files
+    import_diagnostics_csv(plain)
+    import_diagnostics_csv(explicit)
+    before = counts()
+    assert before == (7, 4, 7)
+
+    again = import_diagnostics_csv(plain)
+    assert (again.written, again.unchanged) == (0, 4)
+    again = import_diagnostics_csv(explicit)
+    assert (again.written, again.unchanged) == (0, 3)
+    assert counts() == before
+
+
+def make_legacy(plain_ids: dict):
+    """Приводит базу к виду до естественных ключей: строки файла без diag_id —
+    под номерами строк, отметки миграции нет."""
+    with write_session() as session:
+        for old, new in plain_ids.items():
+            session.execute(update(Inspection).where(Inspection.id == old).values(id=new))
+            session.execute(update(Defect).where(Defect.inspection_id == old).values(inspection_id=new))
+        session.execute(delete(LegacyInspection))
+        session.execute(delete(Meta).where(Meta.key == LEGACY_IDS_KEY))
+        rebuild_rollups(session)
+
+
+def test_upgrade_keeps_explicit_ids_and_replaces_row_numbers(files):
+    plain, explicit = files
+    import_diagnostics_csv(plain)
+    import_diagnostics_csv(explicit)
+    natural = stored_ids().query("id > 1000000")["id"].tolist()
+    make_legacy({old: n for n, old in enumerate(natural, start=1)})
+    assert sorted(stored_ids()["id"]) == [1, 2, 3, 4, 1001, 1002, 1003]
+
+    migrate(write_engine)
+    with write_engine.connect() as conn:
+        recorded = set(conn.execute(select(LegacyInspection.id)).scalars())
+    # Номера строк и явные diag_id по значению не различить — записаны оба вида.
+    assert recorded == {1, 2, 3, 4, 1001, 1002, 1003}
+
+    # Файл с явными id ложится в свои же строки и ничего не удаляет.
+    stats = import_diagnostics_csv(explicit)
+    assert (stats.written, stats.replaced) == (0, 0)
+    assert counts() == (7, 4, 7)
+
+    # Файл без diag_id заменяет свои старые копии, а не ложится рядом.
+    stats = import_diagnostics_csv(plain)
+    assert (stats.inserted, stats.replaced) == (4, 4)
+    assert counts() == (7, 4, 7)
+
+    ids = set(stored_ids()["id"])
+    assert {1001, 1002, 1003} <= ids
+    assert ids.isdisjoint({1, 2, 3, 4})
+    with write_engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(LegacyInspection)).scalar() == 0
+
+    migrate(write_engine)  # повторный запуск миграции ничего не трогает
+    import_diagnostics_csv(plain)
+    import_diagnostics_csv(explicit)
+    assert counts() == (7, 4, 7)
+
+
+def test_legacy_rows_survive_unrelated_imports(files, tmp_path):
+    plain, _ = files
+    import_diagnostics_csv(plain)
+    make_legacy({old: n for n, old in enumerate(stored_ids()["id"].tolist(), start=1)})
+    migrate(write_engine)
+
+    other = write_csv(tmp_path, "other.csv", "object_id,date,method,severity,description\n2,2021-01-01,RT,high,скол\n")
+    stats = import_diagnostics_csv(other)
+    assert stats.replaced == 0
+    assert counts()[0] == 5
+
+
+# ---------------------------
+# Учёт строк: повторы id внутри файла
+# ---------------------------
+
+DUPLICATED_CSV = """diag_id,object_id,date,method,severity,description
+2001,1,2023-01-01,UT,high,первая запись
+2001,1,2023-01-01,UT,high,исправленная запись
+,2,2023-02-02,VT,low,
+,2,2023-02-02,VT,low,
+,,2023-03-03,MT,low,
+"""
+
+
+def accounted(stats):
+    return stats.written + stats.unchanged + stats.rejected + stats.duplicates
+
+
+def test_duplicates_are_counted(empty_db, tmp_path):
+    objects = pd.concat([OBJECTS, OBJECTS.tail(1)], ignore_index=True)
+    stats = import_objects(objects)
+    assert (stats.total, stats.written, stats.duplicates) == (4, 3, 1)
+    assert accounted(stats) == stats.total
+
+    path = write_csv(tmp_path, "dup.csv", DUPLICATED_CSV)
+    stats = import_diagnostics_csv(path)
+    assert (stats.total, stats.written, stats.rejected, stats.duplicates) == (5, 2, 1, 2)
+    assert accounted(stats) == stats.total
+    assert "2 повторов" in str(stats)
+
+    # Побеждает последняя строка с тем же id.
+    with write_engine.connect() as conn:
+        assert conn.execute(select(Inspection.defect_descr).where(Inspection.id == 2001)).scalar() == "исправленная запись"
+
+    again = import_diagnostics_csv(path)
+    assert (again.unchanged, again.duplicates) == (2, 2)
+    assert accounted(again) == again.total
+
+
+def test_blank_ids_parse_with_every_engine(empty_db, tmp_path):
+    # Без chunksize читает pyarrow (если установлен), с chunksize — парсер "c".
+    path = write_csv(tmp_path, "dup.csv", DUPLICATED_CSV)
+    whole = read_csv_typed(path, "diagnostics")
+    chunk = next(read_csv_typed(path, "diagnostics", chunksize=10))
+    assert whole.dtypes.to_dict() == chunk.dtypes.to_dict()
+
+    import_objects(OBJECTS)
+    stats = import_diagnostics_parallel(path, workers=2)
+    assert (stats.total, stats.written, stats.rejected, stats.duplicates) == (5, 2, 1, 2)
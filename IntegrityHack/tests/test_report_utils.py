@@ -0,0 +1,178 @@
+# tests/test_report_utils.py
+#
+# Потоковая генерация отчёта на заглушке клиента OpenAI (без сети).
+
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import delete
+
+from utils.db import init_db, write_session, ReportCache
+from utils.report_utils import (
+    REPORT_MODEL, ReportBuilder, ReportUsage, cached_report, get_cached_report, report_key, stream_report,
+)
+
+
+CHUNKS = ["Общая оцен", "ка: норма.\n", "\nДефект", "ы: <3> шт.\n\nПлан", ": ремонт."]
+
+
+def delta(text):
+    return SimpleNamespace(type="response.output_text.delta", delta=text)
+
+
+def completed(input_tokens=120, output_tokens=40):
+    usage = SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens)
+    return SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=usage))
+
+
+def failed(message="server_error"):
+    return SimpleNamespace(type="response.failed", response=SimpleNamespace(error=message))
+
+
+class StubClient:
+    """client.responses.create(..., stream=True) отдаёт заранее заданные события."""
+
+    def __init__(self, events):
+        self.events = events
+        self.calls = []
+        self.responses = self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        for event in self.events:
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+
+INPUTS = {
+    "total_inspections": 10,
+    "total_objects": 2,
+    "total_defects": 3,
+    "method_stats": {"VIK": 2, "UZK": 1},
+    "crit_stats": {"high": 1, "low": 9},
+    "year_stats": {2023: 4, 2024: 6},
+    "top_objects": {1: 2, 2: 1},
+}
+
+
+@pytest.fixture(autouse=True)
+def report_cache():
+    init_db()
+    with write_session() as session:
+        session.execute(delete(ReportCache))
+    yield
+
+
+# ---------------------------
+# stream_report
+# ---------------------------
+
+def test_stream_yields_chunks_in_order():
+    client = StubClient([delta(c) for c in CHUNKS] + [completed()])
+    usage = ReportUsage()
+
+    parts = list(stream_report(client, "prompt", model="stub-model", usage=usage))
+
+    assert parts == CHUNKS
+    assert "".join(parts) == "".join(CHUNKS)
+    assert client.calls == [{"model": "stub-model", "input": "prompt", "stream": True}]
+    assert (usage.input_tokens, usage.output_tokens) == (120, 40)
+    assert usage.first_token_seconds is not None
+
+
+def test_stream_failed_event_raises_after_partial_text():
+    client = StubClient([delta("Начало "), delta("отчёта"), failed("rate_limit")])
+    received = []
+
+    with pytest.raises(RuntimeError, match="rate_limit"):
+        for part in stream_report(client, "prompt"):
+            received.append(part)
+
+    assert received == ["Начало ", "отчёта"]
+
+
+def test_stream_connection_error_propagates():
+    client = StubClient([delta("Начало"), ConnectionError("reset by peer")])
+
+    with pytest.raises(ConnectionError):
+        list(stream_report(client, "prompt"))
+
+
+# ---------------------------
+# ReportBuilder
+# ---------------------------
+
+def test_builder_converts_finished_paragraphs_incrementally():
+    builder = ReportBuilder()
+
+    assert builder.feed(CHUNKS[0]) is False
+    assert builder.feed(CHUNKS[1]) is False
+    # Абзац ещё не закрыт: html() отдаёт его как есть, но feed не сообщает о новом разделе.
+    assert builder.text == "Общая оценка: норма.\n"
+
+    # "\n" из прошлого куска и "\n" этого вместе закрывают абзац.
+    assert builder.feed(CHUNKS[2]) is True
+    assert "<p>Общая оценка: норма.</p>" in builder.html()
+
+    assert builder.feed(CHUNKS[3]) is True
+    assert "<p>Дефекты: &lt;3&gt; шт.</p>" in builder.html()
+
+
+def test_builder_final_text_and_html():
+    builder = ReportBuilder()
+    for chunk in CHUNKS:
+        builder.feed(chunk)
+
+    assert builder.text == "".join(CHUNKS)
+    page = builder.html()
+    assert page.count("<p>") == 3
+    assert "<p>План: ремонт.</p>" in page  # незакрытый последний абзац тоже попадает
+    assert page.rstrip().endswith("</html>")
+
+
+def test_builder_keeps_partial_text_on_error():
+    builder = ReportBuilder()
+    client = StubClient([delta("Первый абзац.\n\n"), delta("Втор"), failed()])
+
+    with pytest.raises(RuntimeError):
+        for part in stream_report(client, "prompt"):
+            builder.feed(part)
+
+    assert builder.text == "Первый абзац.\n\nВтор"
+    assert "<p>Первый абзац.</p>" in builder.html()
+
+
+# ---------------------------
+# cached_report
+# ---------------------------
+
+def generate_with(client):
+    return lambda prompt: "".join(stream_report(client, prompt))
+
+
+def test_cached_report_stores_completed_stream():
+    client = StubClient([delta(c) for c in CHUNKS] + [completed()])
+
+    report, from_cache = cached_report(INPUTS, "ru", generate_with(client))
+    assert (report, from_cache) == ("".join(CHUNKS), False)
+
+    again, from_cache = cached_report(INPUTS, "ru", generate_with(StubClient([])))
+    assert (again, from_cache) == (report, True)
+    assert len(client.calls) == 1
+
+
+def test_cached_report_skips_interrupted_stream():
+    broken = StubClient([delta("Половина отчё"), failed()])
+
+    with pytest.raises(RuntimeError):
+        cached_report(INPUTS, "ru", generate_with(broken))
+
+    key = report_key(INPUTS, REPORT_MODEL, "ru")
+    assert get_cached_report(key) is None
+
+    # Следующая попытка идёт в API, а не отдаёт обрывок из кэша.
+    client = StubClient([delta("Полный отчёт."), completed()])
+    report, from_cache = cached_report(INPUTS, "ru", generate_with(client))
+    assert (report, from_cache) == ("Полный отчёт.", False)
+    assert len(client.calls) == 1
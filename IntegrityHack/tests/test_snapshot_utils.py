@@ -0,0 +1,78 @@
+# tests/test_snapshot_utils.py
+#
+# KPI по Parquet-снимку: DuckDB и pyarrow должны давать одно и то же.
+
+import random
+from datetime import date
+
+import pytest
+from sqlalchemy import insert, update
+
+from utils import snapshot_utils
+from utils.db import write_session, bump_db_version, get_db_version, Object, Inspection
+
+pytest.importorskip("pyarrow")
+
+FILTERS = [
+    ((), (), None, None),
+    (("UT", "VT"), (), None, None),
+    ((), ("high",), date(2021, 1, 1), None),
+    (("MT",), ("medium", "high"), date(2020, 3, 1), date(2023, 6, 30)),
+    ((), (), None, date(2019, 12, 31)),
+    (("нет такого",), (), None, None),
+]
+
+
+@pytest.fixture
+def snapshot(empty_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot_utils, "SNAPSHOT_DIR", str(tmp_path / "snapshot"))
+    rnd = random.Random(5)
+    with write_session() as session:
+        session.execute(
+            insert(Object),
+            [{"id": i, "object_name": f"obj-{i}", "object_type": rnd.choice(["pipe", "tank"])} for i in range(1, 51)],
+        )
+        session.execute(
+            insert(Inspection),
+            [
+                {
+                    "id": n,
+                    "object_id": rnd.randint(1, 50),
+                    "date": date(rnd.randint(2018, 2024), rnd.randint(1, 12), rnd.randint(1, 28)),
+                    "method": rnd.choice(["UT", "MT", "VT"]),
+                    "ml_label": rnd.choice(["low", "medium", "high"]),
+                    "defect_found": rnd.random() < 0.5,
+                    "row_hash": rnd.getrandbits(62),
+                }
+                for n in range(1, 3001)
+            ],
+        )
+        bump_db_version(session)
+    return snapshot_utils.sync_snapshot()
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_duckdb_matches_arrow(snapshot, filters):
+    pytest.importorskip("duckdb")
+    arrow = snapshot_utils._kpis_arrow(snapshot, *filters, 5)
+    duck = snapshot_utils._kpis_duckdb(snapshot, *filters, 5)
+    assert duck == arrow
+
+
+def test_incremental_sync_rewrites_changed_year(snapshot):
+    before = snapshot_utils._kpis_arrow(snapshot, *FILTERS[0], 5)
+    with write_session() as session:
+        session.execute(
+            update(Inspection)
+            .where(Inspection.date.between(date(2020, 1, 1), date(2020, 12, 31)))
+            .values(ml_label="high", row_hash=Inspection.row_hash + 1)
+        )
+        bump_db_version(session)
+
+    version = snapshot_utils.sync_snapshot()
+    assert version == get_db_version() == snapshot + 1
+
+    after = snapshot_utils._kpis_arrow(version, *FILTERS[0], 5)
+    assert after["total_inspections"] == before["total_inspections"]
+    assert after["total_high"] > before["total_high"]
+    assert snapshot_utils._read_manifest(version).keys() == set(range(2018, 2025))
@@ -0,0 +1,453 @@
+# utils/data_utils.py
+
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import Integer, case, cast, extract, func, select
+
+from utils.db import (
+    engine, get_db_version, Object, Inspection, ObjectMonthRollup, MethodYearRollup
+)
+from utils.map_utils import SEVERITY_LEVELS, build_map_frame
+from utils.snapshot_utils import snapshot_kpis
+
+
+# ---------------------------
+# Доступ к данным для страниц
+# ---------------------------
+#
+# Страницы читают данные из базы, а не из session_state: данные общие для
+# всех пользователей и переживают перезапуск сессии. Результаты кэшируются
+# на уровне процесса; первым аргументом кэшируемых функций идёт версия
+# данных из таблицы meta, импорт её увеличивает — и кэш перестаёт совпадать.
+
+# Колонки objects под именами, которые страницы знают по CSV.
+_OBJECT_COLUMNS = [
+    Object.id.label("object_id"),
+    Object.object_name.label("name"),
+    Object.object_type.label("type"),
+    Object.criticality,
+    Object.lat,
+    Object.lon,
+    Object.name_ru,
+    Object.name_kk,
+    Object.name_en,
+    Object.oblast_ru,
+    Object.oblast_kk,
+    Object.oblast_en,
+    Object.water_type_ru,
+    Object.water_type_kk,
+    Object.water_type_en,
+    Object.fauna_ru,
+    Object.fauna_kk,
+    Object.fauna_en,
+    Object.passport_date,
+    Object.tech_state,
+    Object.coords_center,
+    Object.coords_north,
+    Object.coords_south,
+    Object.coords_east,
+    Object.coords_west,
+]
+
+_DIAGNOSTIC_COLUMNS = [
+    Inspection.id.label("diag_id"),
+    Inspection.object_id,
+    Inspection.date,
+    Inspection.method,
+    Inspection.ml_label.label("severity"),
+    Inspection.defect_found,
+    Inspection.defect_descr.label("description"),
+]
+
+
+def _read(query) -> pd.DataFrame:
+    with engine.connect() as conn:
+        return pd.read_sql(query, conn)
+
+
+def _empty_to_none(df: pd.DataFrame) -> pd.DataFrame:
+    """Пустые строки из импорта показываем как пропуски."""
+    return df.replace("", None)
+
+
+def _filter_diagnostics(query, methods=(), severities=(), date_from=None, date_to=None):
+    if methods:
+        query = query.where(Inspection.method.in_(methods))
+    if severities:
+        query = query.where(Inspection.ml_label.in_(severities))
+    if date_from is not None:
+        query = query.where(Inspection.date >= date_from)
+    if date_to is not None:
+        query = query.where(Inspection.date <= date_to)
+    return query
+
+
+# Наблюдаемая критичность объекта — худшая severity из сводки по диагностикам.
+_SEVERITY_RANK = {"low": 1, "medium": 2, "high": 3}
+
+
+def _observed_criticality():
+    rank = case(
+        *[(ObjectMonthRollup.severity == name, value) for name, value in _SEVERITY_RANK.items()],
+        else_=0,
+    )
+    return (
+        select(ObjectMonthRollup.object_id, func.max(rank).label("rank"))
+        .group_by(ObjectMonthRollup.object_id)
+        .subquery()
+    )
+
+
+def _objects_select(*columns):
+    """SELECT по objects с итоговой критичностью: из паспорта, а если её
+    нет — по результатам диагностик. Возвращает (query, criticality)."""
+    observed = _observed_criticality()
+    criticality = func.coalesce(
+        func.nullif(Object.criticality, ""),
+        case(
+            *[(observed.c.rank == value, name.capitalize()) for name, value in _SEVERITY_RANK.items()],
+            else_=None,
+        ),
+    )
+    query = (
+        select(*columns, criticality.label("criticality"))
+        .select_from(Object)
+        .outerjoin(observed, observed.c.object_id == Object.id)
+    )
+    return query, criticality
+
+
+def _severity_level(criticality):
+    """high/medium/low по подстроке — та же логика, что и у цвета маркера."""
+    lowered = func.lower(criticality)
+    return case(
+        *[(lowered.like(f"%{level}%"), level) for level in SEVERITY_LEVELS],
+        else_=None,
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _load_diagnostics(version: int, methods, severities, date_from, date_to, limit) -> pd.DataFrame:
+    query = _filter_diagnostics(
+        select(*_DIAGNOSTIC_COLUMNS), methods, severities, date_from, date_to
+    ).order_by(Inspection.date.desc(), Inspection.id)
+    if limit is not None:
+        query = query.limit(limit)
+    df = _read(query)
+    df["date"] = pd.to_datetime(df["date"])
+    df["defect_found"] = df["defect_found"].fillna(False).astype(bool)
+    return df
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _diagnostics_options(version: int) -> dict:
+    with engine.connect() as conn:
+        methods = conn.execute(
+            select(Inspection.method).distinct().order_by(Inspection.method)
+        ).scalars().all()
+        severities = conn.execute(
+            select(Inspection.ml_label).distinct().order_by(Inspection.ml_label)
+        ).scalars().all()
+        min_date, max_date = conn.execute(
+            select(func.min(Inspection.date), func.max(Inspection.date))
+        ).one()
+    return {
+        "methods": [m for m in methods if m],
+        "severities": [s for s in severities if s],
+        "min_date": min_date,
+        "max_date": max_date,
+    }
+
+
+def load_diagnostics(methods=(), severities=(), date_from=None, date_to=None, limit=None) -> pd.DataFrame:
+    """Диагностики с фильтрами по методу, критичности (ml_label) и датам."""
+    return _load_diagnostics(
+        get_db_version(), tuple(methods), tuple(severities), date_from, date_to, limit
+    )
+
+
+def diagnostics_options() -> dict:
+    """Значения для фильтров: методы, уровни критичности, границы дат."""
+    return _diagnostics_options(get_db_version())
+
+
+# ---------------------------
+# KPI дашборда и отчёта
+# ---------------------------
+
+@dataclass(frozen=True)
+class KpiFilters:
+    """Фильтры KPI; пустой кортеж — без ограничения."""
+
+    methods: tuple = ()
+    severities: tuple = ()
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+
+TOP_OBJECTS_LIMIT = 5
+
+
+def _kpis_from_rollups(conn) -> dict:
+    """KPI без фильтров — из сводных таблиц, без сканирования inspections."""
+    om, my = ObjectMonthRollup, MethodYearRollup
+
+    total_inspections, total_defects = conn.execute(
+        select(func.sum(om.inspections), func.sum(om.defects))
+    ).one()
+    total_high = conn.execute(
+        select(func.sum(om.inspections)).where(om.severity == "high")
+    ).scalar()
+    severity_counts = conn.execute(
+        select(om.severity, func.sum(om.inspections))
+        .group_by(om.severity)
+        .order_by(func.sum(om.inspections).desc(), om.severity)
+    ).all()
+    method_defects = conn.execute(
+        select(my.method, func.sum(my.defects))
+        .group_by(my.method)
+        .having(func.sum(my.defects) > 0)
+        .order_by(func.sum(my.defects).desc(), my.method)
+    ).all()
+    year_counts = conn.execute(
+        select(my.year, func.sum(my.inspections)).group_by(my.year).order_by(my.year)
+    ).all()
+    top_objects = conn.execute(
+        select(om.object_id, func.sum(om.defects))
+        .group_by(om.object_id)
+        .having(func.sum(om.defects) > 0)
+        .order_by(func.sum(om.defects).desc(), om.object_id)
+        .limit(TOP_OBJECTS_LIMIT)
+    ).all()
+
+    return {
+        "total_inspections": total_inspections or 0,
+        "total_defects": total_defects or 0,
+        "total_high": total_high or 0,
+        "severity_counts": dict(severity_counts),
+        "method_defects": dict(method_defects),
+        "year_counts": {int(y): n for y, n in year_counts if y is not None},
+        "top_objects": dict(top_objects),
+    }
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _compute_kpis(version: int, methods, severities, date_from, date_to) -> dict:
+    if not (methods or severities or date_from or date_to):
+        with engine.connect() as conn:
+            kpis = _kpis_from_rollups(conn)
+            kpis["total_objects"] = conn.execute(select(func.count(Object.id))).scalar()
+        return kpis
+
+    # Колоночный снимок: сканируются только нужные столбцы и разделы по годам.
+    kpis = snapshot_kpis(version, methods, severities, date_from, date_to, TOP_OBJECTS_LIMIT)
+    if kpis is not None:
+        with engine.connect() as conn:
+            kpis["total_objects"] = conn.execute(select(func.count(Object.id))).scalar()
+        return kpis
+
+    def filtered(*columns):
+        return _filter_diagnostics(select(*columns), methods, severities, date_from, date_to)
+
+    defects = func.sum(case((Inspection.defect_found, 1), else_=0))
+    year = extract("year", Inspection.date)
+
+    with engine.connect() as conn:
+        total_objects = conn.execute(select(func.count(Object.id))).scalar()
+        total_inspections, total_defects, total_high = conn.execute(
+            filtered(
+                func.count(),
+                defects,
+                func.sum(case((Inspection.ml_label == "high", 1), else_=0)),
+            )
+        ).one()
+        severity_counts = conn.execute(
+            filtered(Inspection.ml_label, func.count())
+            .group_by(Inspection.ml_label)
+            .order_by(func.count().desc(), Inspection.ml_label)
+        ).all()
+        method_defects = conn.execute(
+            filtered(Inspection.method, func.count())
+            .where(Inspection.defect_found)
+            .group_by(Inspection.method)
+            .order_by(func.count().desc(), Inspection.method)
+        ).all()
+        year_counts = conn.execute(
+            filtered(year, func.count()).group_by(year).order_by(year)
+        ).all()
+        top_objects = conn.execute(
+            filtered(Inspection.object_id, func.count())
+            .where(Inspection.defect_found)
+            .group_by(Inspection.object_id)
+            .order_by(func.count().desc(), Inspection.object_id)
+            .limit(TOP_OBJECTS_LIMIT)
+        ).all()
+
+    return {
+        "total_inspections": total_inspections,
+        "total_objects": total_objects,
+        "total_defects": total_defects or 0,
+        "total_high": total_high or 0,
+        "severity_counts": dict(severity_counts),
+        "method_defects": dict(method_defects),
+        "year_counts": {int(y): n for y, n in year_counts if y is not None},
+        "top_objects": dict(top_objects),
+    }
+
+
+def compute_kpis(filters: Optional[KpiFilters] = None) -> dict:
+    """KPI по диагностикам одним набором GROUP BY-запросов.
+
+    Возвращает total_inspections, total_objects, total_defects, total_high
+    и словари severity_counts, method_defects, year_counts, top_objects.
+    Без фильтров читает сводные таблицы, с фильтрами — Parquet-снимок
+    (utils/snapshot_utils.py), если он актуален, иначе группирует inspections.
+    Считается один раз на версию данных и набор фильтров.
+    """
+    filters = filters or KpiFilters()
+    return _compute_kpis(
+        get_db_version(),
+        tuple(filters.methods),
+        tuple(filters.severities),
+        filters.date_from,
+        filters.date_to,
+    )
+
+
+# ---------------------------
+# Карта: окно просмотра и кластеры
+# ---------------------------
+#
+# Карта запрашивает только объекты внутри окна просмотра (индекс по lat/lon),
+# а если их слишком много — сетку кластеров, агрегированную в SQL.
+
+@dataclass(frozen=True)
+class MapFilters:
+    """Фильтры карты: типы и критичность как в паспорте, levels — high/medium/low."""
+
+    types: tuple = ()
+    criticalities: tuple = ()
+    levels: tuple = ()
+
+
+def _filter_objects(query, criticality, filters: MapFilters, bbox=None):
+    query = query.where(Object.lat.is_not(None)).where(Object.lon.is_not(None))
+    if filters.types:
+        query = query.where(Object.object_type.in_(filters.types))
+    if filters.criticalities:
+        query = query.where(criticality.in_(filters.criticalities))
+    if filters.levels:
+        query = query.where(_severity_level(criticality).in_(filters.levels))
+    if bbox is not None:
+        south, west, north, east = bbox
+        query = query.where(Object.lat.between(south, north)).where(Object.lon.between(west, east))
+    return query
+
+
+def _grid_cell(column, offset: float, size: float):
+    """Номер ячейки сетки; сдвиг делает значения положительными."""
+    value = (column + offset) / size
+    if engine.dialect.name == "sqlite":
+        # CAST в SQLite отбрасывает дробную часть — для положительных это floor.
+        return cast(value, Integer)
+    return func.floor(value)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _map_options(version: int) -> dict:
+    crit_query, criticality = _objects_select()
+    with engine.connect() as conn:
+        min_lat, max_lat, min_lon, max_lon, mid_lat, mid_lon, total = conn.execute(
+            select(
+                func.min(Object.lat), func.max(Object.lat),
+                func.min(Object.lon), func.max(Object.lon),
+                func.avg(Object.lat), func.avg(Object.lon),
+                func.count(),
+            )
+            .where(Object.lat.is_not(None))
+            .where(Object.lon.is_not(None))
+        ).one()
+        types = conn.execute(
+            select(Object.object_type).distinct().order_by(Object.object_type)
+        ).scalars().all()
+        criticalities = conn.execute(
+            crit_query.with_only_columns(criticality).distinct().order_by(criticality)
+        ).scalars().all()
+        objects = conn.execute(select(func.count(Object.id))).scalar()
+    return {
+        "objects": objects,
+        "total": total,
+        "bounds": (min_lat, min_lon, max_lat, max_lon),
+        "midpoint": (mid_lat, mid_lon),
+        "types": [v for v in types if v],
+        "criticalities": [v for v in criticalities if v],
+    }
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _map_counts(version: int, filters: MapFilters, bbox) -> dict:
+    query, criticality = _objects_select(func.count())
+    level = _severity_level(criticality)
+    query = query.with_only_columns(
+        func.count(),
+        func.sum(case((level == "high", 1), else_=0)),
+        func.sum(case((level == "medium", 1), else_=0)),
+    )
+    with engine.connect() as conn:
+        total, high, medium = conn.execute(_filter_objects(query, criticality, filters, bbox)).one()
+    return {"total": total or 0, "high": high or 0, "medium": medium or 0}
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _load_viewport_objects(version, filters, bbox, lang, type_labels, crit_labels, limit):
+    query, criticality = _objects_select(
+        *[c for c in _OBJECT_COLUMNS if c.key != "criticality"]
+    )
+    query = _filter_objects(query, criticality, filters, bbox).order_by(Object.id).limit(limit)
+    objects_df = _empty_to_none(_read(query))
+    return build_map_frame(objects_df, lang, type_labels, crit_labels)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _load_clusters(version, filters, bbox, cell_size) -> pd.DataFrame:
+    query, criticality = _objects_select()
+    level = _severity_level(criticality)
+    lat_cell = _grid_cell(Object.lat, 90, cell_size)
+    lon_cell = _grid_cell(Object.lon, 180, cell_size)
+    query = query.with_only_columns(
+        func.count().label("count"),
+        func.avg(Object.lat).label("lat"),
+        func.avg(Object.lon).label("lon"),
+        func.sum(case((level == "high", 1), else_=0)).label("high"),
+        func.sum(case((level == "medium", 1), else_=0)).label("medium"),
+        func.sum(case((level == "low", 1), else_=0)).label("low"),
+    )
+    query = _filter_objects(query, criticality, filters, bbox).group_by(lat_cell, lon_cell)
+    return _read(query)
+
+
+def map_options() -> dict:
+    """Число объектов (objects — всего, total — с координатами), границы
+    и центр облака точек, значения фильтров типа и критичности."""
+    return _map_options(get_db_version())
+
+
+def map_counts(filters: MapFilters, bbox=None) -> dict:
+    """Число объектов (всего / High / Medium) по фильтрам и, опционально, в окне."""
+    return _map_counts(get_db_version(), filters, bbox)
+
+
+def load_viewport_objects(filters: MapFilters, bbox, lang: str, type_labels: dict, crit_labels: dict, limit: int):
+    """Объекты окна просмотра, готовые к отрисовке (см. build_map_frame)."""
+    return _load_viewport_objects(
+        get_db_version(), filters, bbox, lang, type_labels, crit_labels, limit
+    )
+
+
+def load_clusters(filters: MapFilters, bbox, cell_size: float) -> pd.DataFrame:
+    """Кластеры сетки cell_size° внутри окна: число объектов, центр и разбивка по критичности."""
+    return _load_clusters(get_db_version(), filters, bbox, cell_size)
@@ -0,0 +1,684 @@
+# utils/import_utils.py
+
+import io
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from utils.db import (
+    write_session, bump_db_version, rollup_keys, refresh_rollups,
+    Object, Inspection, Defect, LegacyInspection,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк отправляем в базу одним executemany.
+DEFAULT_BATCH_SIZE = 5000
+
+# Сколько строк CSV читаем за раз в потоковом режиме.
+DEFAULT_CHUNK_SIZE = 50_000
+
+# Размер диапазона файла для одного процесса при параллельном разборе.
+DEFAULT_RANGE_BYTES = 8 * 2**20
+
+
+# Текстовые колонки паспорта объекта, которые переносим из CSV как есть.
+OBJECT_PASSPORT_COLUMNS = [
+    "name_ru", "name_kk", "name_en",
+    "oblast_ru", "oblast_kk", "oblast_en",
+    "resource_type_ru", "resource_type_kk", "resource_type_en",
+    "water_type_ru", "water_type_kk", "water_type_en",
+    "fauna_ru", "fauna_kk", "fauna_en",
+    "passport_date", "tech_state",
+    "coords_center", "coords_north", "coords_south", "coords_east", "coords_west",
+]
+
+
+# ---------------------------
+# Схема CSV
+# ---------------------------
+#
+# Колонки — как в анкетах бота (OBJECT_FIELDS / DIAG_FIELDS) плюс старые
+# названия из шаблонов Streamlit. Справочные значения с малым числом
+# вариантов читаем сразу как category, свободный текст — как string.
+# Числовые колонки не объявляем: мусорное значение в колонке с явным int
+# уронило бы чтение всего файла, а выведенный парсером тип мягко
+# приводится в normalize_* (такая строка просто отклоняется).
+
+_LANGS = ("ru", "kk", "en")
+
+OBJECT_CSV_DTYPES = {
+    **dict.fromkeys(
+        ["type", "object_type", "criticality", "material", "pipeline", "tech_state"],
+        "category",
+    ),
+    **{
+        f"{base}_{lang}": "category"
+        for base in ("oblast", "resource_type", "water_type")
+        for lang in _LANGS
+    },
+    **dict.fromkeys(
+        ["name", "object_name", *(f"name_{lang}" for lang in _LANGS),
+         *(f"fauna_{lang}" for lang in _LANGS), "passport_date",
+         "coords_center", "coords_north", "coords_south", "coords_east", "coords_west"],
+        "string",
+    ),
+}
+
+DIAG_CSV_DTYPES = {
+    **dict.fromkeys(
+        ["method", "severity", *(f"{base}_{lang}" for base in ("method", "severity") for lang in _LANGS)],
+        "category",
+    ),
+    **dict.fromkeys(
+        ["date", "description", *(f"description_{lang}" for lang in _LANGS)],
+        "string",
+    ),
+}
+
+CSV_DTYPES = {"objects": OBJECT_CSV_DTYPES, "diagnostics": DIAG_CSV_DTYPES}
+
+try:
+    import pyarrow  # noqa: F401
+
+    # Многопоточный парсер; не умеет chunksize/nrows/skiprows — там остаётся "c".
+    CSV_ENGINE = "pyarrow"
+except ImportError:  # pragma: no cover
+    CSV_ENGINE = "c"
+
+_STREAMING_ARGS = {"chunksize", "nrows", "skiprows"}
+
+
+def _typed(frame: pd.DataFrame) -> pd.DataFrame:
+    if "date" in frame.columns:
+        frame["date"] = parse_dates(frame["date"])
+    return frame
+
+
+def read_csv_typed(source, kind: str, **kwargs):
+    """pd.read_csv по объявленной схеме kind ("objects"/"diagnostics").
+
+    Колонка date сразу разбирается в datetime. Колонки вне схемы читаются
+    как вывел парсер. С chunksize возвращает итератор типизированных кусков.
+    """
+    dtypes = CSV_DTYPES[kind]
+    engine = "c" if _STREAMING_ARGS & kwargs.keys() else CSV_ENGINE
+    if engine == "pyarrow":
+        # pyarrow с dtype приводит к схеме и остальные колонки: целые с пропусками
+        # (пустой diag_id) падают. Схему накладываем после разбора, на то, что есть в файле.
+        frame = pd.read_csv(source, engine=engine, **kwargs)
+        return _typed(frame.astype({name: dtype for name, dtype in dtypes.items() if name in frame.columns}))
+
+    reader = pd.read_csv(source, dtype=dtypes, engine=engine, **kwargs)
+    if kwargs.get("chunksize"):
+        return (_typed(chunk) for chunk in reader)
+    return _typed(reader)
+
+
+# ---------------------------
+# Статистика импорта
+# ---------------------------
+
+@dataclass
+class ImportStats:
+    """Итоги импорта одной таблицы.
+
+    written = inserted + updated; unchanged — строки, чей хэш содержимого
+    совпал с уже сохранённым, в базу они не пишутся; duplicates — повторы id
+    внутри файла (остаётся последняя строка), так что
+    total = written + unchanged + rejected + duplicates; replaced — удалённые
+    старые копии тех же осмотров под id из прежних импортов.
+    """
+
+    table: str
+    total: int = 0
+    written: int = 0
+    rejected: int = 0
+    duplicates: int = 0
+    seconds: float = 0.0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    replaced: int = 0
+
+    def add_delta(self, inserted: int, updated: int, unchanged: int):
+        self.inserted += inserted
+        self.updated += updated
+        self.unchanged += unchanged
+        self.written += inserted + updated
+
+    @property
+    def changed(self) -> int:
+        """Сколько строк базы изменил импорт (для версии данных)."""
+        return self.written + self.replaced
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.total / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.table}: {self.inserted} новых, {self.updated} изменено, "
+            f"{self.unchanged} без изменений, {self.rejected} отклонено, {self.duplicates} повторов, "
+            f"{self.replaced} старых копий удалено "
+            f"из {self.total} за {self.seconds:.2f} с ({self.rows_per_sec:,.0f} строк/с)"
+        )
+
+
+# ---------------------------
+# Векторная нормализация колонок
+# ---------------------------
+
+def _column(df: pd.DataFrame, *names, default=None) -> pd.Series:
+    """Первая найденная колонка из списка имён, иначе колонка со значением default."""
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return pd.Series(default, index=df.index, dtype="object")
+
+
+def _to_str(series: pd.Series) -> pd.Series:
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Чистим словарь категорий, а не каждую строку; код -1 (NaN) → "".
+        categories = _to_str(pd.Series(series.cat.categories)).to_numpy()
+        values = np.append(categories, "")[series.cat.codes.to_numpy()]
+        return pd.Series(values, index=series.index, dtype=object)
+    return series.astype("string").fillna("").str.strip().astype(object)
+
+
+def _to_float(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series, errors="coerce")
+
+
+def _to_int(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series, errors="coerce").astype("Int64")
+
+
+def parse_dates(series: pd.Series) -> pd.Series:
+    """Разбираем даты форматов YYYY-MM-DD и DD.MM.YYYY, прочее — через mixed."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    raw = series.astype("string").str.strip()
+    parsed = pd.to_datetime(raw, format="%Y-%m-%d", errors="coerce")
+    rest = parsed.isna() & raw.notna()
+    if rest.any():
+        parsed[rest] = pd.to_datetime(raw[rest], format="%d.%m.%Y", errors="coerce")
+        rest = parsed.isna() & raw.notna()
+    if rest.any():
+        parsed[rest] = pd.to_datetime(raw[rest], format="mixed", errors="coerce")
+    return parsed
+
+
+def normalize_objects(objects_df: pd.DataFrame):
+    """Готовим строки для таблицы objects. Возвращает (records, rejected, duplicates)."""
+    ids = _to_int(_column(objects_df, "object_id"))
+    valid = ids.notna()
+
+    frame = pd.DataFrame(
+        {
+            "id": ids,
+            "object_name": _to_str(_column(objects_df, "object_name", "name", "name_ru", default="")),
+            "object_type": _to_str(_column(objects_df, "object_type", "type", default="")),
+            "pipeline": _to_str(_column(objects_df, "pipeline", default="")),
+            "lat": _to_float(_column(objects_df, "lat")),
+            "lon": _to_float(_column(objects_df, "lon")),
+            "year": _to_int(_column(objects_df, "year")),
+            "material": _to_str(_column(objects_df, "material", default="")),
+            "criticality": _to_str(_column(objects_df, "criticality", default="")),
+            **{
+                name: _to_str(_column(objects_df, name, default=""))
+                for name in OBJECT_PASSPORT_COLUMNS
+            },
+        }
+    )[valid]
+    # Повтор object_id в файле: как и merge раньше — побеждает последняя строка.
+    duplicates = int(frame["id"].duplicated(keep="last").sum())
+    frame = frame.drop_duplicates(subset="id", keep="last")
+    frame["row_hash"] = row_hashes(frame)
+
+    return _records(frame), int((~valid).sum()), duplicates
+
+
+def normalize_diagnostics(diagnostics_df: pd.DataFrame):
+    """Готовим строки для inspections/defects.
+    Возвращает (inspections, defects, rejected, duplicates)."""
+    object_ids = _to_int(_column(diagnostics_df, "object_id"))
+    dates = parse_dates(_column(diagnostics_df, "date"))
+    valid = object_ids.notna() & dates.notna()
+
+    severity = _to_str(_column(diagnostics_df, "severity", default="")).str.lower()
+    defect_found = severity != "low"
+
+    frame = pd.DataFrame(
+        {
+            "object_id": object_ids,
+            "date": dates.dt.date,
+            "method": _to_str(_column(diagnostics_df, "method", default="")),
+            "defect_found": defect_found,
+            "defect_descr": _to_str(
+                _column(diagnostics_df, "description", "description_ru", default="")
+            ),
+            "ml_label": severity,
+        }
+    )[valid]
+    # Явный diag_id, если он есть; иначе — хэш естественного ключа, чтобы
+    # повторный импорт и разные файлы попадали в одни и те же строки.
+    explicit = _to_int(_column(diagnostics_df, "diag_id"))[valid]
+    frame.insert(0, "id", explicit.fillna(natural_ids(frame)).astype("int64"))
+    duplicates = int(frame["id"].duplicated(keep="last").sum())
+    frame = frame.drop_duplicates(subset="id", keep="last")
+    frame["row_hash"] = row_hashes(frame)
+
+    defects = frame.loc[
+        frame["defect_found"], ["id", "ml_label", "defect_descr"]
+    ].rename(
+        columns={"id": "inspection_id", "ml_label": "severity", "defect_descr": "description"}
+    )
+
+    return _records(frame), _records(defects), int((~valid).sum()), duplicates
+
+
+def natural_ids(frame: pd.DataFrame) -> pd.Series:
+    """Стабильный diag_id: 63-битный хэш (object_id, date, method, описание).
+    Старший бит сбрасываем — id остаётся положительным BIGINT."""
+    key = pd.DataFrame(
+        {
+            "object_id": frame["object_id"].astype("int64"),
+            "date": frame["date"].astype(str),
+            "method": frame["method"],
+            "description": frame["defect_descr"],
+        }
+    )
+    hashes = pd.util.hash_pandas_object(key, index=False).to_numpy() >> 1
+    return pd.Series(hashes.astype("int64"), index=frame.index)
+
+
+def inspection_natural_ids(rows: pd.DataFrame) -> pd.Series:
+    """natural_ids для строк, прочитанных из таблицы inspections (миграция старых id)."""
+    frame = pd.DataFrame(
+        {
+            "object_id": rows["object_id"],
+            "date": pd.to_datetime(rows["date"]).dt.date,
+            "method": _to_str(rows["method"]),
+            "defect_descr": _to_str(rows["defect_descr"]),
+        }
+    )
+    return natural_ids(frame)
+
+
+def row_hashes(frame: pd.DataFrame) -> pd.Series:
+    """64-битный хэш содержимого каждой строки (знаковый — помещается в BIGINT)."""
+    hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy().view("int64")
+    return pd.Series(hashes, index=frame.index)
+
+
+def _records(frame: pd.DataFrame) -> list:
+    """DataFrame → список dict с питоновскими типами (NaN/NA → None)."""
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict("records")
+
+
+# ---------------------------
+# Пакетная запись в базу
+# ---------------------------
+
+_DIALECT_INSERT = {
+    "sqlite": sqlite_insert,
+    "postgresql": postgresql_insert,
+}
+
+
+def _upsert(session, model, rows: list, key: str = "id"):
+    """INSERT ... ON CONFLICT(key) DO UPDATE для пачки строк одним executemany.
+    Обновляются только колонки, пришедшие в строках (кроме ключа и первичного ключа)."""
+    # Других баз make_engine не создаёт (SUPPORTED_BACKENDS).
+    stmt = _DIALECT_INSERT[session.get_bind().dialect.name](model)
+    update_cols = {
+        col.name: stmt.excluded[col.name]
+        for col in model.__table__.columns
+        if not col.primary_key and col.name != key and col.name in rows[0]
+    }
+    stmt = stmt.on_conflict_do_update(index_elements=[key], set_=update_cols)
+    session.execute(stmt, rows)
+
+
+def _write_batches(write_batch, rows: list, batch_size: int):
+    for start in range(0, len(rows), batch_size):
+        write_batch(rows[start:start + batch_size])
+
+
+def _delta(session, model, batch: list):
+    """Оставляет в пачке новые и изменённые строки по row_hash.
+    Возвращает (changed, inserted, updated, unchanged)."""
+    stored = dict(
+        session.execute(
+            select(model.id, model.row_hash).where(model.id.in_([row["id"] for row in batch]))
+        ).all()
+    )
+    changed = [row for row in batch if stored.get(row["id"]) != row["row_hash"]]
+    inserted = sum(row["id"] not in stored for row in changed)
+    return changed, inserted, len(changed) - inserted, len(batch) - len(changed)
+
+
+def _write_objects(session, rows: list, batch_size: int, stats: ImportStats):
+    for start in range(0, len(rows), batch_size):
+        changed, inserted, updated, unchanged = _delta(session, Object, rows[start:start + batch_size])
+        if changed:
+            _upsert(session, Object, changed)
+        stats.add_delta(inserted, updated, unchanged)
+
+
+def import_objects(objects_df: pd.DataFrame, batch_size: int = DEFAULT_BATCH_SIZE) -> ImportStats:
+    """Массовый upsert Objects.csv в таблицу objects (только новые и изменённые строки)."""
+    stats = ImportStats("objects", total=len(objects_df))
+    started = time.perf_counter()
+
+    rows, stats.rejected, stats.duplicates = normalize_objects(objects_df)
+
+    with write_session() as session:
+        _write_objects(session, rows, batch_size, stats)
+        if stats.written:
+            bump_db_version(session)
+
+    stats.seconds = time.perf_counter() - started
+    logger.info("Импорт %s", stats)
+    return stats
+
+
+def _replace_legacy(session, batch: list) -> tuple:
+    """Удаляет старые копии осмотров пачки: строки из legacy_inspections с тем же
+    естественным ключом, но другим id (номер строки прежнего импорта).
+    Строка, пришедшая под своим же id (явный diag_id), просто перестаёт быть
+    старой. Возвращает (число удалённых, их ключи сводок — взятые до удаления)."""
+    natural = inspection_natural_ids(pd.DataFrame.from_records(batch)).tolist()
+    matched = session.execute(
+        select(LegacyInspection.id).where(LegacyInspection.natural_id.in_(set(natural)))
+    ).scalars().all()
+    if not matched:
+        return 0, None
+    incoming = {row["id"] for row in batch}
+    stale = [legacy_id for legacy_id in matched if legacy_id not in incoming]
+    keys = rollup_keys(session, stale)
+    if stale:
+        session.execute(delete(Defect).where(Defect.inspection_id.in_(stale)))
+        session.execute(delete(Inspection).where(Inspection.id.in_(stale)))
+    session.execute(delete(LegacyInspection).where(LegacyInspection.id.in_(matched)))
+    return len(stale), keys
+
+
+def _write_diagnostics(session, inspections: list, defects: list, batch_size: int, stats: ImportStats):
+    written_ids = set()
+    object_ids, periods, methods, years = set(), set(), set(), set()
+    # Старые копии ищем, только пока они есть (базы, обновлённые со старых импортов).
+    has_legacy = session.execute(select(LegacyInspection.id).limit(1)).first() is not None
+    for start in range(0, len(inspections), batch_size):
+        if has_legacy:
+            replaced, old_keys = _replace_legacy(session, inspections[start:start + batch_size])
+            if replaced:
+                for keys, old in zip((object_ids, periods, methods, years), old_keys):
+                    keys |= old
+                stats.replaced += replaced
+        batch, inserted, updated, unchanged = _delta(session, Inspection, inspections[start:start + batch_size])
+        stats.add_delta(inserted, updated, unchanged)
+        if not batch:
+            continue
+        # Старые ключи сводок — до upsert, новые — из самих строк.
+        for keys, old in zip((object_ids, periods, methods, years), rollup_keys(session, [row["id"] for row in batch])):
+            keys |= old
+        _upsert(session, Inspection, batch)
+        for row in batch:
+            written_ids.add(row["id"])
+            object_ids.add(row["object_id"])
+            periods.add(row["date"].year * 100 + row["date"].month)
+            methods.add(row["method"])
+            years.add(row["date"].year)
+    # Сводки пересчитываем один раз на вызов, а не на каждую пачку.
+    if written_ids or object_ids:
+        refresh_rollups(session, object_ids, periods, methods, years)
+    # Дефекты — только у записанных осмотров; у неизменённых они уже есть.
+    # Один дефект на осмотр: upsert по inspection_id, а если осмотр больше
+    # не дефектный (severity стала low) — его дефект удаляем.
+    defects = [row for row in defects if row["inspection_id"] in written_ids]
+    _write_batches(
+        lambda batch: _upsert(session, Defect, batch, key="inspection_id"), defects, batch_size
+    )
+    cleared = list(written_ids - {row["inspection_id"] for row in defects})
+    _write_batches(
+        lambda batch: session.execute(delete(Defect).where(Defect.inspection_id.in_(batch))),
+        cleared,
+        batch_size,
+    )
+
+
+# ---------------------------
+# Потоковый импорт больших файлов
+# ---------------------------
+
+def _source_size(source) -> int:
+    """Размер файла/буфера в байтах (0, если узнать нельзя)."""
+    size = getattr(source, "size", None)
+    if size is not None:
+        return int(size)
+    try:
+        position = source.tell()
+        source.seek(0, io.SEEK_END)
+        size = source.tell()
+        source.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return 0
+
+
+def import_diagnostics_csv(
+    source,
+    chunksize: int = DEFAULT_CHUNK_SIZE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_chunk=None,
+    skip_rows: int = 0,
+    on_commit=None,
+    should_stop=None,
+) -> ImportStats:
+    """Читаем Diagnostics.csv кусками по chunksize строк и пишем каждый сразу в базу.
+
+    В памяти одновременно живёт только один кусок, поэтому расход памяти
+    не зависит от размера файла. on_chunk(chunk, bytes_read, bytes_total)
+    вызывается после коммита каждого куска — для прогресс-бара и превью.
+
+    Для фоновых задач: skip_rows — сколько строк данных пропустить (продолжение
+    прерванного импорта), on_commit(session, stats, bytes_read) — запись
+    прогресса в той же транзакции, что и кусок, should_stop() — проверка
+    отмены между кусками.
+    """
+    stats = ImportStats("inspections")
+    started = time.perf_counter()
+    bytes_total = _source_size(source)
+    skiprows = range(1, skip_rows + 1) if skip_rows else None
+
+    for chunk in read_csv_typed(source, "diagnostics", chunksize=chunksize, skiprows=skiprows):
+        inspections, defects, rejected, duplicates = normalize_diagnostics(chunk)
+        # Сессия писателя — на кусок: разбор следующего куска идёт без блокировки,
+        # и короткие записи UI (кэш отчётов, статусы задач) не ждут конца файла.
+        with write_session() as session:
+            changed = stats.changed
+            _write_diagnostics(session, inspections, defects, batch_size, stats)
+            # Версию данных (ключ кэша страниц) двигаем, только если что-то записали.
+            if stats.changed > changed:
+                bump_db_version(session)
+
+            stats.total += len(chunk)
+            stats.rejected += rejected
+            stats.duplicates += duplicates
+            bytes_read = source.tell() if hasattr(source, "tell") else 0
+            if on_commit is not None:
+                on_commit(session, stats, bytes_read)
+
+        if on_chunk is not None:
+            on_chunk(chunk, bytes_read, bytes_total)
+        del chunk, inspections, defects
+        if should_stop is not None and should_stop():
+            break
+
+    stats.seconds = time.perf_counter() - started
+    logger.info("Потоковый импорт %s", stats)
+    return stats
+
+
+# ---------------------------
+# Приём записей из Telegram-бота
+# ---------------------------
+
+def ingest_records(kind: str, records: list, batch_size: int = DEFAULT_BATCH_SIZE) -> ImportStats:
+    """Записи анкет и CSV из бота (dict с колонками как в CSV) — сразу в базу.
+
+    kind — "objects" или "diagnostics". Проверка та же, что у импорта файлов:
+    строки без object_id (и даты — для диагностик) отклоняются. Повторно
+    присланная анкета диагностики без diag_id попадает в ту же строку.
+    """
+    df = pd.DataFrame.from_records(records)
+    stats = ImportStats(kind, total=len(df))
+    started = time.perf_counter()
+
+    with write_session() as session:
+        if kind == "objects":
+            rows, stats.rejected, stats.duplicates = normalize_objects(df)
+            _write_objects(session, rows, batch_size, stats)
+        elif kind == "diagnostics":
+            rows, defects, stats.rejected, stats.duplicates = normalize_diagnostics(df)
+            _write_diagnostics(session, rows, defects, batch_size, stats)
+        else:
+            raise ValueError(f"Неизвестный тип записей: {kind}")
+        if stats.changed:
+            bump_db_version(session)
+
+    stats.seconds = time.perf_counter() - started
+    logger.info("Приём из бота %s", stats)
+    return stats
+
+
+# ---------------------------
+# Параллельный разбор больших файлов
+# ---------------------------
+#
+# Разбор дат и нормализация строк упираются в один процессор. Файл режется
+# на диапазоны байтов по границам строк, каждый диапазон разбирают отдельные
+# процессы, а единственный писатель применяет результаты строго по порядку
+# файла. Как и skip_rows у потокового импорта, предполагается, что внутри
+# значений нет переводов строк (одна запись — одна строка файла).
+
+def _skip_lines(f, count: int, block: int = 2**20):
+    """Сдвигает файл на count строк вперёд (поиск переводов строк блоками)."""
+    while count > 0:
+        start = f.tell()
+        data = f.read(block)
+        if not data:
+            return
+        found = data.count(b"\n")
+        if found < count:
+            count -= found
+            continue
+        # Нужная строка в этом блоке — находим позицию count-го перевода.
+        pos = -1
+        for _ in range(count):
+            pos = data.index(b"\n", pos + 1)
+        f.seek(start + pos + 1)
+        return
+
+
+def split_byte_ranges(path: str, range_bytes: int = DEFAULT_RANGE_BYTES, skip_rows: int = 0):
+    """Возвращает (строка заголовка, [(start, end), ...]) — диапазоны по границам строк."""
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as f:
+        header = f.readline()
+        _skip_lines(f, skip_rows)
+        pos = f.tell()
+        while pos < size:
+            f.seek(min(pos + range_bytes, size))
+            f.readline()  # дочитываем до конца строки
+            end = f.tell()
+            ranges.append((pos, end))
+            pos = end
+    return header, ranges
+
+
+def _parse_range(path: str, header: bytes, start: int, end: int):
+    """Выполняется в дочернем процессе: чтение диапазона и нормализация."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    chunk = read_csv_typed(io.BytesIO(header + data), "diagnostics")
+    inspections, defects, rejected, duplicates = normalize_diagnostics(chunk)
+    return len(chunk), inspections, defects, rejected, duplicates
+
+
+def import_diagnostics_parallel(
+    path: str,
+    workers: int = None,
+    range_bytes: int = DEFAULT_RANGE_BYTES,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    skip_rows: int = 0,
+    on_commit=None,
+    should_stop=None,
+) -> ImportStats:
+    """Импорт Diagnostics.csv с разбором в пуле процессов.
+
+    Параметры skip_rows/on_commit/should_stop — как у import_diagnostics_csv;
+    bytes_read в on_commit — точный конец закоммиченного диапазона.
+    В работе не больше 2 * workers диапазонов, так что память ограничена.
+    """
+    stats = ImportStats("inspections")
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    header, ranges = split_byte_ranges(path, range_bytes, skip_rows)
+
+    # spawn: форк процесса с потоками Streamlit и открытыми соединениями небезопасен.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        todo = iter(ranges)
+        pending = deque()
+
+        def fill():
+            while len(pending) < 2 * workers:
+                span = next(todo, None)
+                if span is None:
+                    return
+                pending.append((span, pool.submit(_parse_range, path, header, *span)))
+
+        fill()
+        while pending:
+            (_, end), future = pending.popleft()
+            rows, inspections, defects, rejected, duplicates = future.result()
+            fill()
+
+            # Как и в import_diagnostics_csv: блокировка писателя — только на запись диапазона.
+            with write_session() as session:
+                changed = stats.changed
+                _write_diagnostics(session, inspections, defects, batch_size, stats)
+                if stats.changed > changed:
+                    bump_db_version(session)
+                stats.total += rows
+                stats.rejected += rejected
+                stats.duplicates += duplicates
+                if on_commit is not None:
+                    on_commit(session, stats, end)
+            del inspections, defects
+
+            if should_stop is not None and should_stop():
+                for _, future in pending:
+                    future.cancel()
+                break
+
+    stats.seconds = time.perf_counter() - started
+    logger.info("Параллельный импорт (%d процессов) %s", workers, stats)
+    return stats
@@ -0,0 +1,237 @@
+# utils/jobs.py
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import getenv
+
+from sqlalchemy import select, update
+
+from utils.db import SessionLocal, write_session, ImportJob
+from utils.import_utils import (
+    DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE,
+    import_objects, import_diagnostics_csv, import_diagnostics_parallel, read_csv_typed,
+)
+from utils.snapshot_utils import sync_snapshot
+
+
+logger = logging.getLogger(__name__)
+
+# Куда складываем копии загруженных CSV: задача переживает обновление страницы.
+IMPORT_SPOOL_DIR = getenv("IMPORT_SPOOL_DIR", "import_spool")
+
+ACTIVE_STATUSES = ("queued", "running")
+RESUMABLE_STATUSES = ("failed", "cancelled", "interrupted")
+
+
+# ---------------------------
+# Чтение состояния задач (для UI)
+# ---------------------------
+
+def get_job(job_id: str):
+    with SessionLocal() as session:
+        return session.get(ImportJob, job_id)
+
+
+def recent_jobs(statuses=None, limit: int = 10) -> list:
+    query = select(ImportJob).order_by(ImportJob.created_at.desc()).limit(limit)
+    if statuses:
+        query = query.where(ImportJob.status.in_(statuses))
+    with SessionLocal() as session:
+        return session.execute(query).scalars().all()
+
+
+def job_fraction(job) -> float:
+    """Доля выполнения по байтам файла диагностик (0…1)."""
+    if job.status == "done":
+        return 1.0
+    if not job.bytes_total:
+        return 0.0
+    return min(job.bytes_done / job.bytes_total, 1.0)
+
+
+# ---------------------------
+# Исполнитель
+# ---------------------------
+
+def _set(job_id: str, **values):
+    values["updated_at"] = datetime.now()
+    with write_session() as session:
+        session.execute(update(ImportJob).where(ImportJob.id == job_id).values(**values))
+
+
+class ImportJobRunner:
+    """Импорт в фоновых потоках со своими сессиями БД.
+
+    Прогресс и статус пишутся в таблицу import_jobs, UI её опрашивает.
+    Каждый кусок диагностик коммитится вместе с прогрессом задачи, поэтому
+    прерванная или отменённая задача продолжается с последнего куска.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 1,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        spool_dir: str = IMPORT_SPOOL_DIR,
+        parse_workers: int = 1,
+    ):
+        self.parse_workers = parse_workers
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.spool_dir = spool_dir
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="import-job")
+        self._cancel = {}
+        self._lock = threading.Lock()
+        os.makedirs(spool_dir, exist_ok=True)
+
+        # Задачи, которые выполнял прошлый процесс, уже никто не ведёт.
+        with write_session() as session:
+            session.execute(
+                update(ImportJob)
+                .where(ImportJob.status.in_(ACTIVE_STATUSES))
+                .values(status="interrupted", updated_at=datetime.now())
+            )
+
+    def _spool(self, job_id: str, kind: str, uploaded) -> str:
+        path = os.path.join(self.spool_dir, f"{job_id}_{kind}.csv")
+        with open(path, "wb") as out:
+            out.write(uploaded.getbuffer())
+        return path
+
+    def submit(self, objects_file, diagnostics_file) -> str:
+        """Сохраняет загруженные файлы и ставит задачу в очередь; возвращает id."""
+        job_id = uuid.uuid4().hex
+        objects_path = self._spool(job_id, "objects", objects_file)
+        diagnostics_path = self._spool(job_id, "diagnostics", diagnostics_file)
+        with write_session() as session:
+            session.add(
+                ImportJob(
+                    id=job_id,
+                    status="queued",
+                    objects_path=objects_path,
+                    diagnostics_path=diagnostics_path,
+                    objects_done=False,
+                    bytes_total=os.path.getsize(diagnostics_path),
+                    bytes_done=0,
+                    rows_done=0,
+                    rows_written=0,
+                    rows_rejected=0,
+                    rows_duplicate=0,
+                    created_at=datetime.now(),
+                )
+            )
+        self._start(job_id)
+        return job_id
+
+    def resume(self, job_id: str) -> bool:
+        job = get_job(job_id)
+        if job is None or job.status not in RESUMABLE_STATUSES:
+            return False
+        _set(job_id, status="queued", error=None)
+        self._start(job_id)
+        return True
+
+    def cancel(self, job_id: str):
+        """Отмена срабатывает между кусками: уже записанное остаётся в базе."""
+        with self._lock:
+            event = self._cancel.get(job_id)
+        if event is not None:
+            event.set()
+
+    def _start(self, job_id: str):
+        with self._lock:
+            self._cancel[job_id] = threading.Event()
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id: str):
+        cancel = self._cancel[job_id]
+        try:
+            self._import(job_id, cancel)
+        except Exception as e:
+            logger.exception("Задача импорта %s упала", job_id)
+            _set(job_id, status="failed", error=str(e), finished_at=datetime.now())
+        finally:
+            with self._lock:
+                self._cancel.pop(job_id, None)
+
+    def _import(self, job_id: str, cancel: threading.Event):
+        job = get_job(job_id)
+        _set(job_id, status="running")
+
+        if not job.objects_done:
+            objects_stats = import_objects(read_csv_typed(job.objects_path, "objects"), batch_size=self.batch_size)
+            _set(job_id, objects_done=True, summary=str(objects_stats))
+            job.summary = str(objects_stats)
+
+        base_rows, base_written, base_rejected = job.rows_done, job.rows_written, job.rows_rejected
+        base_duplicate = job.rows_duplicate or 0  # колонка добавлена миграцией — у старых задач NULL
+        started = time.perf_counter()
+
+        def on_commit(session, stats, bytes_read):
+            elapsed = time.perf_counter() - started
+            rate = stats.total / elapsed if elapsed > 0 else 0.0
+            # ETA по байтам: строки бывают разной длины, а размер файла известен.
+            byte_rate = (bytes_read - job.bytes_done) / elapsed if elapsed > 0 else 0.0
+            eta = (job.bytes_total - bytes_read) / byte_rate if byte_rate > 0 else None
+            session.execute(
+                update(ImportJob)
+                .where(ImportJob.id == job_id)
+                .values(
+                    bytes_done=bytes_read,
+                    rows_done=base_rows + stats.total,
+                    rows_written=base_written + stats.written,
+                    rows_rejected=base_rejected + stats.rejected,
+                    rows_duplicate=base_duplicate + stats.duplicates,
+                    rows_per_sec=rate,
+                    eta_seconds=eta,
+                    updated_at=datetime.now(),
+                )
+            )
+
+        if self.parse_workers > 1:
+            stats = import_diagnostics_parallel(
+                job.diagnostics_path,
+                workers=self.parse_workers,
+                batch_size=self.batch_size,
+                skip_rows=base_rows,
+                on_commit=on_commit,
+                should_stop=cancel.is_set,
+            )
+        else:
+            with open(job.diagnostics_path, "rb") as source:
+                stats = import_diagnostics_csv(
+                    source,
+                    chunksize=self.chunk_size,
+                    batch_size=self.batch_size,
+                    skip_rows=base_rows,
+                    on_commit=on_commit,
+                    should_stop=cancel.is_set,
+                )
+
+        if cancel.is_set():
+            _set(job_id, status="cancelled", finished_at=datetime.now())
+            return
+
+        _set(
+            job_id,
+            status="done",
+            bytes_done=job.bytes_total,
+            eta_seconds=0.0,
+            summary=f"{job.summary}\n{stats}",
+            finished_at=datetime.now(),
+        )
+        for path in (job.objects_path, job.diagnostics_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+        # Снимок для аналитики догоняет новую версию данных. Ошибка здесь не
+        # портит импорт: пока снимок отстаёт, KPI считаются по SQL.
+        try:
+            sync_snapshot()
+        except Exception:
+            logger.exception("Не удалось обновить Parquet-снимок после задачи %s", job_id)
@@ -0,0 +1,224 @@
+# utils/map_utils.py
+
+import math
+from html import escape
+
+import numpy as np
+import pandas as pd
+
+
+# ---------------------------
+# Цвета маркеров
+# ---------------------------
+
+# Палитра RGB по уровню критичности; последний элемент — для неизвестных значений.
+SEVERITY_LEVELS = ["high", "medium", "low"]
+SEVERITY_PALETTE = np.array(
+    [
+        [255, 0, 0],       # high
+        [255, 165, 0],     # medium
+        [0, 200, 0],       # low
+        [100, 149, 237],   # прочее
+    ],
+    dtype=np.uint8,
+)
+NO_CRIT_COLOR = np.array([0, 128, 255], dtype=np.uint8)
+
+
+def _severity_index(value) -> int:
+    """Индекс в палитре; как и раньше, ищем подстроку (High, high-risk и т.п.)."""
+    text = str(value).lower()
+    for idx, level in enumerate(SEVERITY_LEVELS):
+        if level in text:
+            return idx
+    return len(SEVERITY_LEVELS)
+
+
+def severity_keys(values: pd.Series) -> pd.Series:
+    """Категориальная колонка high/medium/low/<NA> для фильтров и подсчётов."""
+    if values.isna().all():
+        # Колонки критичности нет или она пустая — у всех объектов <NA>.
+        return pd.Series(pd.Categorical([None] * len(values), categories=SEVERITY_LEVELS), index=values.index)
+    cat = values.astype("category")
+    lut = np.array(
+        [_severity_index(c) for c in cat.cat.categories] + [len(SEVERITY_LEVELS)],
+        dtype=np.intp,
+    )
+    keys = np.array(SEVERITY_LEVELS + [None], dtype=object)[lut[cat.cat.codes.to_numpy()]]
+    return pd.Series(pd.Categorical(keys, categories=SEVERITY_LEVELS), index=values.index)
+
+
+def severity_colors(values: pd.Series) -> np.ndarray:
+    """Массив (n, 3) uint8: цвет считается один раз на уникальное значение,
+    строки получают его через таблицу подстановки по кодам категорий."""
+    cat = values.astype("category")
+    lut = np.array(
+        [_severity_index(c) for c in cat.cat.categories] + [len(SEVERITY_LEVELS)],
+        dtype=np.intp,
+    )
+    # Код -1 (пропуск) попадает на последний элемент lut — «прочее».
+    return SEVERITY_PALETTE[lut[cat.cat.codes.to_numpy()]]
+
+
+# ---------------------------
+# Локализованные поля подсказки
+# ---------------------------
+
+def localized(df: pd.DataFrame, base: str, lang: str) -> pd.Series:
+    """Колонка base_<lang>, с откатом на base_ru и base для пустых значений."""
+    candidates = [f"{base}_{lang}", f"{base}_ru", base]
+    result = pd.Series(None, index=df.index, dtype="object")
+    for name in dict.fromkeys(candidates):
+        if name in df.columns:
+            result = result.fillna(df[name])
+    return result.fillna("")
+
+
+def _translate(values: pd.Series, labels: dict) -> pd.Series:
+    """Перевод через категории: словарь применяется к уникальным значениям."""
+    cat = values.astype(str).astype("category")
+    return cat.cat.rename_categories(
+        [labels.get(c, c) for c in cat.cat.categories]
+    ).astype(str)
+
+
+def build_map_frame(objects_df: pd.DataFrame, lang: str, type_labels: dict, crit_labels: dict) -> pd.DataFrame:
+    """Готовит объекты к отрисовке: координаты, цвет r/g/b, ключ критичности
+    и *_ui-колонки подсказки на выбранном языке. Все операции векторные."""
+    df = objects_df.dropna(subset=["lat", "lon"]).reset_index(drop=True)
+    has_crit = df["criticality"].notna().any()
+
+    if has_crit:
+        colors = severity_colors(df["criticality"])
+    else:
+        colors = np.broadcast_to(NO_CRIT_COLOR, (len(df), 3))
+
+    ui = pd.DataFrame(
+        {
+            "r": colors[:, 0],
+            "g": colors[:, 1],
+            "b": colors[:, 2],
+            "crit_key": severity_keys(df["criticality"]),
+            "name_ui": localized(df, "name", lang),
+            "region_ui": localized(df, "oblast", lang),
+            "type_ui": _translate(df["type"].fillna(""), type_labels.get(lang, {})),
+            "water_type_ui": localized(df, "water_type", lang),
+            "fauna_ui": localized(df, "fauna", lang),
+            "passport_date_ui": df["passport_date"].fillna(""),
+            "tech_state_ui": df["tech_state"].fillna("").astype(str),
+            "coords_center_ui": df["coords_center"].fillna(""),
+            "coords_north_ui": df["coords_north"].fillna(""),
+            "coords_south_ui": df["coords_south"].fillna(""),
+            "coords_east_ui": df["coords_east"].fillna(""),
+            "coords_west_ui": df["coords_west"].fillna(""),
+            "crit_ui": (
+                _translate(df["criticality"].fillna(""), crit_labels.get(lang, {}))
+                if has_crit else ""
+            ),
+        },
+        index=df.index,
+    )
+    return pd.concat([df, ui], axis=1)
+
+
+# ---------------------------
+# Компактная передача в браузер
+# ---------------------------
+
+# Пять знаков после запятой — около метра, больше для маркера не нужно.
+COORD_DECIMALS = 5
+
+
+def compact_layer_data(frame: pd.DataFrame) -> pd.DataFrame:
+    """Минимум для ScatterplotLayer: id, координаты и цвет без текстовых колонок.
+    Подсказка подтягивается на сервере по выбранному object_id."""
+    return pd.DataFrame(
+        {
+            "object_id": frame["object_id"].to_numpy(),
+            "lon": frame["lon"].round(COORD_DECIMALS).to_numpy(),
+            "lat": frame["lat"].round(COORD_DECIMALS).to_numpy(),
+            "r": frame["r"].to_numpy(),
+            "g": frame["g"].to_numpy(),
+            "b": frame["b"].to_numpy(),
+        }
+    )
+
+
+def render_tooltip(template: str, row: pd.Series) -> str:
+    """Подставляет значения объекта в HTML-шаблон подсказки deck.gl ({field})."""
+    return template.format_map(
+        {key: escape(str(value)) for key, value in row.items()}
+    )
+
+
+# ---------------------------
+# Окно просмотра и кластеры
+# ---------------------------
+
+TILE_SIZE = 256
+
+
+def zoom_for_bounds(bounds) -> int:
+    """Стартовый зум по размаху координат (south, west, north, east)."""
+    south, west, north, east = bounds
+    max_range = max(north - south, east - west)
+    if max_range < 0.1:
+        return 12
+    elif max_range < 1:
+        return 9
+    elif max_range < 10:
+        return 6
+    return 4
+
+
+def degrees_per_pixel(zoom: float) -> float:
+    """Градусов долготы на пиксель в проекции Web Mercator."""
+    return 360.0 / (TILE_SIZE * 2 ** zoom)
+
+
+def viewport_bbox(lat: float, lon: float, zoom: float, width_px: int, height_px: int) -> tuple:
+    """Прямоугольник (south, west, north, east), видимый в окне карты.
+    Округляем, чтобы близкие окна попадали в один ключ кэша."""
+    deg = degrees_per_pixel(zoom)
+    half_lon = width_px / 2 * deg
+    half_lat = height_px / 2 * deg * math.cos(math.radians(lat))
+    return (
+        round(max(lat - half_lat, -90.0), 4),
+        round(max(lon - half_lon, -180.0), 4),
+        round(min(lat + half_lat, 90.0), 4),
+        round(min(lon + half_lon, 180.0), 4),
+    )
+
+
+def cluster_layer_data(clusters: pd.DataFrame) -> pd.DataFrame:
+    """Кластеры для ScatterplotLayer: цвет по средневзвешенной критичности
+    (low=1 … high=3, от зелёного к красному), радиус ~ sqrt(числа объектов)."""
+    rated = clusters["high"] + clusters["medium"] + clusters["low"]
+    score = (
+        (3 * clusters["high"] + 2 * clusters["medium"] + clusters["low"])
+        / rated.where(rated > 0)
+    ).to_numpy()
+
+    # Палитра в порядке low → medium → high, интерполяция по score.
+    ramp = SEVERITY_PALETTE[[2, 1, 0]].astype(float)
+    position = np.nan_to_num(score - 1, nan=0.0)
+    colors = np.stack(
+        [np.interp(position, [0, 1, 2], ramp[:, channel]) for channel in range(3)],
+        axis=1,
+    ).astype(np.uint8)
+    colors[np.isnan(score)] = SEVERITY_PALETTE[-1]
+
+    return pd.DataFrame(
+        {
+            "lon": clusters["lon"].round(COORD_DECIMALS).to_numpy(),
+            "lat": clusters["lat"].round(COORD_DECIMALS).to_numpy(),
+            "r": colors[:, 0],
+            "g": colors[:, 1],
+            "b": colors[:, 2],
+            "radius": (6 + 3 * np.sqrt(clusters["count"].to_numpy())).round(1),
+            "count": clusters["count"].to_numpy(),
+            "high": clusters["high"].to_numpy(),
+            "medium": clusters["medium"].to_numpy(),
+            "low": clusters["low"].to_numpy(),
+        }
+    )
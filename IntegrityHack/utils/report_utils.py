@@ -0,0 +1,779 @@
+# utils/report_utils.py
+
+import asyncio
+import csv
+import functools
+import hashlib
+import html
+import io
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from os import getenv
+from typing import Optional
+
+import pandas as pd
+from sqlalchemy import delete, func, select, update
+
+from utils.db import (
+    engine, SessionLocal, write_session,
+    Object, Inspection, ReportCache, ObjectReport,
+)
+
+
+logger = logging.getLogger(__name__)
+
+REPORT_MODEL = getenv("REPORT_MODEL", "gpt-4.1-mini")
+
+# Сколько живёт готовый отчёт и сколько отчётов держим (вытесняются давно не открытые).
+REPORT_CACHE_TTL = timedelta(seconds=int(getenv("REPORT_CACHE_TTL", 7 * 24 * 3600)))
+REPORT_CACHE_MAX = int(getenv("REPORT_CACHE_MAX", 200))
+
+REPORT_LANGUAGES = {"ru": "русском", "kk": "казахском", "en": "английском"}
+
+
+# ---------------------------
+# Промпт и бюджет токенов
+# ---------------------------
+#
+# Словари KPI растут с числом методов, лет и объектов, а repr словаря
+# дорог в токенах. Промпт собирается из компактных таблиц "ключ | число";
+# если оценка превышает бюджет, самая длинная таблица укорачивается вдвое
+# (хвост сворачивается в строку "прочие"), пока промпт не уложится.
+
+# Бюджеты входных токенов для сводного отчёта и отчёта по объекту.
+REPORT_PROMPT_TOKENS = int(getenv("REPORT_PROMPT_TOKENS", 2000))
+OBJECT_PROMPT_TOKENS = int(getenv("OBJECT_PROMPT_TOKENS", 1500))
+# Короче таблицы не делаем, даже если бюджет не выдержан.
+MIN_TABLE_ROWS = 3
+
+@functools.cache
+def _encoding():
+    """Словарь tiktoken — при первой оценке, а не при импорте: его сборка (и загрузка,
+    если файла нет в кэше) не должна задерживать старт приложения."""
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:  # tiktoken необязателен (или нет словаря офлайн)
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """Число токенов: точно через tiktoken, иначе с запасом — токен на 3 символа
+    (кириллица и цифры у BPE-словарей GPT дробятся мельче латиницы)."""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return -(-len(text) // 3)
+
+
+def compact_table(counts: dict, header: str, limit: int = None, keep: str = "head") -> str:
+    """{ключ: число} → строки "ключ | число"; сверх limit строк — одна строка-итог.
+    keep="head" оставляет первые строки (словари KPI уже отсортированы по убыванию),
+    "tail" — последние (годы: ранние сворачиваются в "до …")."""
+    items = list(counts.items())
+    if not items:
+        return "нет данных"
+    rest = []
+    if limit is not None and len(items) > max(limit, 2):
+        limit = max(limit, 2)
+        if keep == "tail":
+            rest, items = items[:len(items) - limit + 1], items[len(items) - limit + 1:]
+        else:
+            items, rest = items[:limit - 1], items[limit - 1:]
+    lines = [header] + [f"{key} | {value}" for key, value in items]
+    if rest:
+        total = sum(value for _, value in rest)
+        label = f"до {items[0][0]}" if keep == "tail" else f"прочие ({len(rest)})"
+        lines.insert(1 if keep == "tail" else len(lines), f"{label} | {total}")
+    return "\n".join(lines)
+
+
+def fit_prompt(render, sizes: dict, budget: int) -> str:
+    """render(limits) -> промпт; limits — строк на таблицу. Самая длинная таблица
+    укорачивается вдвое, пока промпт не уложится в budget или таблицы не кончатся."""
+    limits = dict(sizes)
+    while True:
+        prompt = render(limits)
+        if estimate_tokens(prompt) <= budget:
+            return prompt
+        name = max(limits, key=limits.get)
+        if limits[name] <= MIN_TABLE_ROWS:
+            logger.warning("Промпт больше бюджета: %d > %d токенов", estimate_tokens(prompt), budget)
+            return prompt
+        limits[name] = max(MIN_TABLE_ROWS, limits[name] // 2)
+
+
+@dataclass
+class ReportUsage:
+    """Метрики одного отчёта: оценка промпта, фактические токены из ответа API и время."""
+
+    prompt_tokens: int = 0                 # оценка estimate_tokens до отправки
+    input_tokens: Optional[int] = None     # usage из ответа API
+    output_tokens: Optional[int] = None
+    seconds: float = 0.0
+    first_token_seconds: Optional[float] = None
+
+    def record(self, usage):
+        if usage is not None:
+            self.input_tokens = getattr(usage, "input_tokens", None)
+            self.output_tokens = getattr(usage, "output_tokens", None)
+
+    def __str__(self) -> str:
+        tokens_in = self.input_tokens if self.input_tokens is not None else f"~{self.prompt_tokens}"
+        tokens_out = self.output_tokens if self.output_tokens is not None else "—"
+        text = f"токены: вход {tokens_in}, выход {tokens_out}; {self.seconds:.1f} с"
+        if self.first_token_seconds is not None:
+            text += f", первый текст через {self.first_token_seconds:.2f} с"
+        return text
+
+
+def report_inputs(kpis: dict) -> dict:
+    """Данные дашборда, которые попадают в промпт отчёта."""
+    return {
+        "total_inspections": kpis["total_inspections"],
+        "total_objects": kpis["total_objects"],
+        "total_defects": kpis["total_defects"],
+        "method_stats": kpis["method_defects"],
+        "crit_stats": kpis["severity_counts"],
+        "year_stats": kpis["year_counts"],
+        "top_objects": kpis["top_objects"],
+    }
+
+
+def build_report_prompt(inputs: dict, lang: str = "ru", budget: int = None) -> str:
+    """Промпт сводного отчёта: таблицы ужимаются, пока промпт не влезет в budget токенов."""
+    language = REPORT_LANGUAGES.get(lang, REPORT_LANGUAGES["ru"])
+    tables = {
+        "method_stats": (inputs["method_stats"], "метод | дефектов", "head"),
+        "crit_stats": (inputs["crit_stats"], "критичность | обследований", "head"),
+        # Для динамики важнее последние годы — ранние сворачиваем в одну строку.
+        "year_stats": (inputs["year_stats"], "год | обследований", "tail"),
+        "top_objects": (inputs["top_objects"], "object_id | дефектов", "head"),
+    }
+
+    def render(limits):
+        t = {
+            name: compact_table(counts, header, limits[name], keep)
+            for name, (counts, header, keep) in tables.items()
+        }
+        return f"""
+Ты — инженер по промышленной безопасности.
+Ниже данные технического дашборда IntegrityOS, который анализирует объекты инфраструктуры.
+
+Проанализируй эти данные как эксперт и составь:
+
+1) Общую оценку ситуации
+2) Краткий анализ дефектов
+3) Какие методы контроля наиболее эффективны
+4) Какие объекты наиболее проблемные и почему
+5) Что нужно сделать в первую очередь (приоритетный план работы)
+6) Риски, если ничего не делать
+7) Профессиональные рекомендации инженера
+
+ДАННЫЕ ДАШБОРДА:
+
+- Всего обследований: {inputs["total_inspections"]}
+- Всего объектов: {inputs["total_objects"]}
+- Количество дефектов: {inputs["total_defects"]}
+
+Методы контроля (дефекты):
+{t["method_stats"]}
+
+Распределение по критичности:
+{t["crit_stats"]}
+
+Динамика по годам:
+{t["year_stats"]}
+
+Топ проблемных объектов:
+{t["top_objects"]}
+
+Проанализируй эти данные и сформируй профессиональный технический отчёт.
+Не выдумывай данные — анализируй только то, что дано.
+Пиши отчёт на {language} языке.
+"""
+
+    sizes = {name: len(counts) for name, (counts, _, _) in tables.items()}
+    return fit_prompt(render, sizes, REPORT_PROMPT_TOKENS if budget is None else budget)
+
+
+# ---------------------------
+# Кэш отчётов (таблица report_cache)
+# ---------------------------
+
+def _normalized(value):
+    """Ключи словарей — строки и по порядку: {2023: 5} и {"2023": 5} дают один ключ."""
+    if isinstance(value, dict):
+        return {str(k): _normalized(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_normalized(v) for v in value]
+    if hasattr(value, "item"):  # numpy-скаляры
+        return value.item()
+    return value
+
+
+def report_key(inputs: dict, model: str, lang: str) -> str:
+    payload = json.dumps(
+        # Бюджет меняет текст промпта — отчёт под другим бюджетом другой.
+        {"inputs": _normalized(inputs), "model": model, "lang": lang, "budget": REPORT_PROMPT_TOKENS},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached_report(key: str):
+    """Текст отчёта из кэша или None (нет или истёк TTL). Попадание обновляет used_at."""
+    now = datetime.now()
+    with SessionLocal() as session:
+        entry = session.get(ReportCache, key)
+        if entry is None or entry.created_at < now - REPORT_CACHE_TTL:
+            return None
+        report = entry.report
+    with write_session() as session:
+        session.execute(
+            update(ReportCache)
+            .where(ReportCache.key == key)
+            .values(used_at=now, hits=ReportCache.hits + 1)
+        )
+    return report
+
+
+def store_report(key: str, model: str, lang: str, report: str, usage: ReportUsage = None):
+    """Сохраняет отчёт и вытесняет истёкшие и лишние (давно не открытые) записи."""
+    now = datetime.now()
+    usage = usage or ReportUsage()
+    with write_session() as session:
+        session.merge(
+            ReportCache(
+                key=key, model=model, lang=lang, report=report, hits=0, created_at=now, used_at=now,
+                input_tokens=usage.input_tokens, output_tokens=usage.output_tokens, seconds=usage.seconds,
+            )
+        )
+        session.flush()
+        session.execute(delete(ReportCache).where(ReportCache.created_at < now - REPORT_CACHE_TTL))
+        keep = select(ReportCache.key).order_by(ReportCache.used_at.desc()).limit(REPORT_CACHE_MAX)
+        session.execute(delete(ReportCache).where(ReportCache.key.not_in(keep)))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.report = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def cached_report(
+    inputs: dict,
+    lang: str,
+    generate,
+    model: str = REPORT_MODEL,
+    force: bool = False,
+    usage: ReportUsage = None,
+):
+    """Отчёт по данным дашборда: из кэша или через generate(prompt) -> str.
+
+    Одновременные промахи по одному ключу (несколько вкладок нажали кнопку)
+    сводятся к одному вызову generate, остальные ждут его результат
+    (в пределах процесса Streamlit). force=True — сгенерировать заново.
+    usage заполняется при генерации (оценка промпта, время; токены ответа —
+    если generate передаст usage в stream_report). Возвращает (report, from_cache).
+    """
+    key = report_key(inputs, model, lang)
+    if not force:
+        report = get_cached_report(key)
+        if report is not None:
+            return report, True
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.report, True
+
+    try:
+        # Предыдущий ведущий мог закончить между нашей проверкой кэша и захватом ключа.
+        cached = None if force else get_cached_report(key)
+        if cached is not None:
+            flight.report = cached
+            return cached, True
+        usage = usage or ReportUsage()
+        prompt = build_report_prompt(inputs, lang)
+        usage.prompt_tokens = estimate_tokens(prompt)
+        started = time.perf_counter()
+        flight.report = generate(prompt)
+        usage.seconds = time.perf_counter() - started
+        logger.info("Отчёт %s (%s): %s", key[:12], model, usage)
+        try:
+            store_report(key, model, lang, flight.report, usage)
+        except Exception:
+            # Отчёт уже оплачен и получен — отдаём его, даже если кэш не записался.
+            logger.exception("Не удалось сохранить отчёт в кэш")
+        return flight.report, False
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+# ---------------------------
+# Потоковая генерация и HTML
+# ---------------------------
+
+def stream_report(client, prompt: str, model: str = REPORT_MODEL, usage: ReportUsage = None):
+    """Текст отчёта кусками по мере генерации (Responses API, stream=True).
+
+    client — любой объект с responses.create(...), возвращающим поток событий;
+    подменяется заглушкой без сети. usage получает время до первого текста
+    и токены из финального события response.completed.
+    """
+    started = time.perf_counter()
+    events = client.responses.create(model=model, input=prompt, stream=True)
+    for event in events:
+        if event.type == "response.output_text.delta":
+            if usage is not None and usage.first_token_seconds is None:
+                usage.first_token_seconds = time.perf_counter() - started
+            yield event.delta
+        elif event.type == "response.completed" and usage is not None:
+            usage.record(getattr(event.response, "usage", None))
+        elif event.type in ("response.failed", "error"):
+            error = getattr(event, "error", None) or getattr(getattr(event, "response", None), "error", None)
+            raise RuntimeError(f"Генерация отчёта прервана: {error}")
+
+
+REPORT_HTML_HEAD = """
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>IntegrityOS – GPT-отчёт</title>
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            margin: 30px;
+            line-height: 1.6;
+            font-size: 16px;
+        }
+        p {
+            margin-bottom: 15px;
+        }
+    </style>
+</head>
+<body>
+"""
+
+REPORT_HTML_TAIL = """
+</body>
+</html>
+"""
+
+
+class ReportBuilder:
+    """Собирает отчёт по мере прихода текста.
+
+    text — весь текст на данный момент (для st.markdown); абзацы (разделитель —
+    пустая строка) переводятся в HTML, как только закончились, поэтому к концу
+    генерации HTML почти готов и html() лишь дописывает последний абзац.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._paragraphs = []
+        self._tail = ""
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, delta: str) -> bool:
+        """Добавляет кусок; True, если закончился хотя бы один абзац (новый раздел)."""
+        self._parts.append(delta)
+        *done, self._tail = (self._tail + delta).split("\n\n")
+        self._paragraphs.extend(self._paragraph_html(p) for p in done if p.strip())
+        return bool(done)
+
+    @staticmethod
+    def _paragraph_html(paragraph: str) -> str:
+        return "<p>" + html.escape(paragraph.strip()).replace("\n", "<br>") + "</p>"
+
+    def html(self) -> str:
+        paragraphs = list(self._paragraphs)
+        if self._tail.strip():
+            paragraphs.append(self._paragraph_html(self._tail))
+        return REPORT_HTML_HEAD + "\n".join(paragraphs) + REPORT_HTML_TAIL
+
+
+# ---------------------------
+# Пакетные отчёты по объектам
+# ---------------------------
+
+# Одновременных запросов к API, попыток на объект и строк истории в промпте.
+REPORT_CONCURRENCY = int(getenv("REPORT_CONCURRENCY", 8))
+REPORT_RETRIES = int(getenv("REPORT_RETRIES", 5))
+REPORT_HISTORY_ROWS = int(getenv("REPORT_HISTORY_ROWS", 30))
+
+# Ошибки API, после которых имеет смысл повторить запрос.
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRY_ERRORS = {"APIConnectionError", "APITimeoutError"}
+
+
+def risk_objects(source: str = "top", limit: int = 20) -> list:
+    """object_id для пакета: "top" — больше всего дефектов, "high" — все с High-диагностикой."""
+    if source == "high":
+        query = (
+            select(Inspection.object_id)
+            .where(Inspection.ml_label == "high")
+            .group_by(Inspection.object_id)
+            .order_by(func.count().desc(), Inspection.object_id)
+        )
+    else:
+        query = (
+            select(Inspection.object_id)
+            .where(Inspection.defect_found)
+            .group_by(Inspection.object_id)
+            .order_by(func.count().desc(), Inspection.object_id)
+            .limit(limit)
+        )
+    with engine.connect() as conn:
+        return conn.execute(query).scalars().all()
+
+
+def object_report_inputs(object_ids: list) -> dict:
+    """{object_id: данные для промпта} — паспорт, сводка и последние диагностики.
+    Два запроса на весь пакет, а не по два на объект."""
+    with engine.connect() as conn:
+        objects = pd.read_sql(
+            select(
+                Object.id, Object.object_name, Object.object_type, Object.pipeline,
+                Object.year, Object.material, Object.criticality,
+            ).where(Object.id.in_(object_ids)),
+            conn,
+        ).set_index("id")
+        history = pd.read_sql(
+            select(
+                Inspection.object_id, Inspection.date, Inspection.method,
+                Inspection.ml_label, Inspection.defect_found, Inspection.defect_descr,
+            )
+            .where(Inspection.object_id.in_(object_ids))
+            .order_by(Inspection.object_id, Inspection.date.desc()),
+            conn,
+        )
+
+    inputs = {}
+    for object_id, rows in history.groupby("object_id", sort=False):
+        passport = objects.loc[object_id].to_dict() if object_id in objects.index else {}
+        recent = rows.head(REPORT_HISTORY_ROWS)
+        inputs[int(object_id)] = {
+            "object": {k: v for k, v in passport.items() if pd.notna(v) and v != ""},
+            "inspections": len(rows),
+            "defects": int(rows["defect_found"].fillna(False).sum()),
+            "severity_counts": rows["ml_label"].value_counts().to_dict(),
+            "method_defects": rows.loc[rows["defect_found"].fillna(False).astype(bool), "method"]
+            .value_counts().to_dict(),
+            "first_date": str(rows["date"].min()),
+            "last_date": str(rows["date"].max()),
+            "recent": [
+                f"{r.date} | {r.method} | {r.ml_label} | {r.defect_descr or '—'}"
+                for r in recent.itertuples()
+            ],
+        }
+    return inputs
+
+
+def build_object_prompt(object_id: int, inputs: dict, lang: str = "ru", budget: int = None) -> str:
+    """Промпт по объекту; под бюджет урезается история (сначала самые старые) и сводки."""
+    language = REPORT_LANGUAGES.get(lang, REPORT_LANGUAGES["ru"])
+    passport = "; ".join(f"{key}: {value}" for key, value in inputs["object"].items()) or "—"
+
+    def render(limits):
+        recent = inputs["recent"][:limits["recent"]]
+        skipped = len(inputs["recent"]) - len(recent)
+        history = "\n".join(recent + ([f"… ещё {skipped} более ранних"] if skipped else []))
+        severity = compact_table(inputs["severity_counts"], "критичность | обследований", limits["severity"])
+        methods = compact_table(inputs["method_defects"], "метод | дефектов", limits["methods"])
+        return f"""
+Ты — инженер по промышленной безопасности.
+Ниже история диагностики одного объекта из IntegrityOS.
+
+Составь короткое инженерное заключение по объекту:
+
+1) Текущее состояние и уровень риска
+2) Как менялась картина дефектов со временем
+3) Какие методы контроля выявляют проблемы
+4) Что сделать в первую очередь
+5) Когда и каким методом провести следующее обследование
+
+ОБЪЕКТ {object_id}: {passport}
+
+- Обследований: {inputs["inspections"]} ({inputs["first_date"]} — {inputs["last_date"]})
+- Дефектов: {inputs["defects"]}
+
+Распределение по критичности:
+{severity}
+
+Дефекты по методам:
+{methods}
+
+Последние обследования (дата | метод | критичность | описание):
+{history}
+
+Не выдумывай данные — анализируй только то, что дано.
+Пиши заключение на {language} языке.
+"""
+
+    sizes = {
+        "recent": len(inputs["recent"]),
+        "severity": len(inputs["severity_counts"]),
+        "methods": len(inputs["method_defects"]),
+    }
+    return fit_prompt(render, sizes, OBJECT_PROMPT_TOKENS if budget is None else budget)
+
+
+def _retry_after(error) -> float:
+    """Retry-After из ответа API (секунды), если сервер его прислал."""
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _retryable(error) -> bool:
+    return (
+        getattr(error, "status_code", None) in RETRY_STATUS
+        or type(error).__name__ in RETRY_ERRORS
+    )
+
+
+class _RateGate:
+    """Общая пауза для всех воркеров: после 429 никто не шлёт запросы,
+    пока не истечёт Retry-After (или backoff), — иначе лимит только продлевается."""
+
+    def __init__(self):
+        self._resume_at = 0.0
+
+    def hold(self, seconds: float):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def wait(self):
+        delay = self._resume_at - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._resume_at - time.monotonic()
+
+
+async def generate_reports(
+    client,
+    prompts: dict,
+    model: str = REPORT_MODEL,
+    concurrency: int = REPORT_CONCURRENCY,
+    retries: int = REPORT_RETRIES,
+    on_result=None,
+    retry_base: float = 1.0,
+    retry_cap: float = 60.0,
+):
+    """Прогоняет {key: prompt} через client.responses.create (AsyncOpenAI или заглушка).
+
+    Не больше concurrency запросов одновременно; 429/5xx/сетевые ошибки
+    повторяются до retries раз с экспоненциальной задержкой, 429 приостанавливает
+    все воркеры. await on_result(key, report, error, attempts, usage) — по мере
+    готовности (usage — ReportUsage с токенами ответа и временем с учётом повторов).
+    Возвращает {key: (report, error, usage)}.
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    gate = _RateGate()
+    results = {}
+
+    async def run(key, prompt):
+        attempts = 0
+        report, error = None, None
+        usage = ReportUsage(prompt_tokens=estimate_tokens(prompt))
+        started = time.perf_counter()
+        while True:
+            attempts += 1
+            await gate.wait()
+            async with semaphore:
+                try:
+                    response = await client.responses.create(model=model, input=prompt)
+                    report, error = response.output_text, None
+                    usage.record(getattr(response, "usage", None))
+                    break
+                except Exception as e:
+                    error = e
+            if attempts > retries or not _retryable(error):
+                break
+            delay = max(_retry_after(error), min(retry_cap, retry_base * 2 ** (attempts - 1)))
+            delay *= random.uniform(1.0, 1.25)
+            if getattr(error, "status_code", None) == 429:
+                gate.hold(delay)
+            logger.warning("Отчёт %s: попытка %d не удалась (%s), повтор через %.1f с", key, attempts, error, delay)
+            await asyncio.sleep(delay)
+
+        usage.seconds = time.perf_counter() - started
+        logger.info("Отчёт %s: %s", key, usage)
+        results[key] = (report, error, usage)
+        if on_result is not None:
+            await on_result(key, report, error, attempts, usage)
+
+    await asyncio.gather(*(run(key, prompt) for key, prompt in prompts.items()))
+    return results
+
+
+def batch_usage(batch_id: str) -> dict:
+    """Суммарные токены и среднее время отчёта по пакету."""
+    with SessionLocal() as session:
+        input_tokens, output_tokens, seconds = session.execute(
+            select(
+                func.sum(ObjectReport.input_tokens),
+                func.sum(ObjectReport.output_tokens),
+                func.avg(ObjectReport.seconds),
+            ).where(ObjectReport.batch_id == batch_id, ObjectReport.status == "done")
+        ).one()
+    return {"input_tokens": input_tokens or 0, "output_tokens": output_tokens or 0, "seconds": seconds or 0.0}
+
+
+def batch_progress(batch_id: str) -> dict:
+    """{статус: число объектов} для пакета."""
+    with SessionLocal() as session:
+        rows = session.execute(
+            select(ObjectReport.status, func.count())
+            .where(ObjectReport.batch_id == batch_id)
+            .group_by(ObjectReport.status)
+        ).all()
+    return dict(rows)
+
+
+def batch_archive(batch_id: str) -> bytes:
+    """ZIP пакета: по markdown и HTML на объект и index.csv со статусами."""
+    with SessionLocal() as session:
+        reports = session.execute(
+            select(ObjectReport)
+            .where(ObjectReport.batch_id == batch_id)
+            .order_by(ObjectReport.object_id)
+        ).scalars().all()
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        index = io.StringIO()
+        writer = csv.writer(index)
+        writer.writerow(["object_id", "status", "attempts", "input_tokens", "output_tokens", "seconds", "error"])
+        for item in reports:
+            writer.writerow([
+                item.object_id, item.status, item.attempts,
+                item.input_tokens, item.output_tokens,
+                f"{item.seconds:.2f}" if item.seconds is not None else "",
+                item.error or "",
+            ])
+            if item.report:
+                builder = ReportBuilder()
+                builder.feed(item.report)
+                archive.writestr(f"object_{item.object_id}.md", item.report)
+                archive.writestr(f"object_{item.object_id}.html", builder.html())
+        archive.writestr("index.csv", index.getvalue())
+    return buffer.getvalue()
+
+
+class ReportBatchRunner:
+    """Пакеты отчётов по объектам в фоновом потоке со своим event loop.
+
+    client_factory() -> AsyncOpenAI (или совместимая заглушка) создаётся на
+    каждый пакет: асинхронный клиент привязан к своему loop. Результаты
+    пишутся в object_reports по мере готовности, UI опрашивает batch_progress.
+    """
+
+    def __init__(self, client_factory, concurrency: int = REPORT_CONCURRENCY, model: str = REPORT_MODEL):
+        self.client_factory = client_factory
+        self.concurrency = concurrency
+        self.model = model
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="report-batch")
+
+    def submit(self, object_ids: list, lang: str) -> str:
+        batch_id = uuid.uuid4().hex
+        now = datetime.now()
+        with write_session() as session:
+            session.add_all(
+                ObjectReport(
+                    batch_id=batch_id, object_id=object_id, lang=lang, model=self.model,
+                    status="queued", attempts=0, created_at=now,
+                )
+                for object_id in object_ids
+            )
+        self._executor.submit(self._run, batch_id, list(object_ids), lang)
+        return batch_id
+
+    def _run(self, batch_id: str, object_ids: list, lang: str):
+        try:
+            asyncio.run(self._generate(batch_id, object_ids, lang))
+        except Exception as e:
+            logger.exception("Пакет отчётов %s упал", batch_id)
+            with write_session() as session:
+                session.execute(
+                    update(ObjectReport)
+                    .where(ObjectReport.batch_id == batch_id, ObjectReport.status == "queued")
+                    .values(status="failed", error=str(e), finished_at=datetime.now())
+                )
+
+    async def _generate(self, batch_id: str, object_ids: list, lang: str):
+        inputs = object_report_inputs(object_ids)
+        prompts = {
+            object_id: build_object_prompt(object_id, inputs[object_id], lang)
+            for object_id in object_ids
+            if object_id in inputs
+        }
+
+        def save(object_id, report, error, attempts, usage=None):
+            usage = usage or ReportUsage()
+            with write_session() as session:
+                session.execute(
+                    update(ObjectReport)
+                    .where(ObjectReport.batch_id == batch_id, ObjectReport.object_id == object_id)
+                    .values(
+                        status="done" if error is None else "failed",
+                        report=report,
+                        error=None if error is None else str(error),
+                        attempts=attempts,
+                        input_tokens=usage.input_tokens,
+                        output_tokens=usage.output_tokens,
+                        seconds=usage.seconds,
+                        finished_at=datetime.now(),
+                    )
+                )
+
+        async def on_result(object_id, report, error, attempts, usage):
+            await asyncio.to_thread(save, object_id, report, error, attempts, usage)
+
+        for object_id in set(object_ids) - set(prompts):
+            save(object_id, None, "Нет диагностик по объекту", 0)
+
+        client = self.client_factory()
+        try:
+            await generate_reports(
+                client, prompts, model=self.model, concurrency=self.concurrency, on_result=on_result
+            )
+        finally:
+            close = getattr(client, "close", None)
+            if close is not None:
+                await close()
@@ -0,0 +1,361 @@
+# utils/snapshot_utils.py
+
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from os import getenv
+
+import pandas as pd
+from sqlalchemy import extract, func, select
+
+from utils.db import engine, get_db_version, Object, Inspection
+
+# pyarrow и duckdb — необязательные зависимости: без pyarrow снимок не
+# строится и аналитика остаётся на SQL, без duckdb запросы идут через pyarrow.
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:  # pragma: no cover
+    pa = pc = ds = None
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover
+    duckdb = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------
+# Колоночный снимок inspections (Parquet)
+# ---------------------------
+#
+# snapshot/inspections/v<версия>/year=YYYY/object_type=.../*.parquet
+# snapshot/CURRENT — версия данных, которой соответствует готовый снимок.
+# Каждая версия пишется в свой каталог, CURRENT переключается последним,
+# поэтому читатели никогда не видят недописанный снимок. Снимок, отставший
+# от версии в meta, не используется — запросы идут в SQL.
+#
+# Пересобираются только годы, чья контрольная сумма (число строк и суммы
+# хэшей строк inspections и их объектов) изменилась; остальные разделы
+# переходят в новую версию жёсткими ссылками. Суммы лежат в _manifest.json.
+
+SNAPSHOT_DIR = getenv("SNAPSHOT_DIR", "snapshot")
+SNAPSHOT_CHUNK_ROWS = 500_000
+MANIFEST_FILE = "_manifest.json"  # "_" — pyarrow.dataset такие файлы пропускает
+
+_sync_lock = threading.Lock()
+_FINGERPRINT_MOD = 1_000_003  # суммы по модулю, чтобы не переполнить BIGINT
+
+
+def snapshot_available() -> bool:
+    return pa is not None
+
+
+def _current_file() -> str:
+    return os.path.join(SNAPSHOT_DIR, "CURRENT")
+
+
+def _version_dir(version: int) -> str:
+    return os.path.join(SNAPSHOT_DIR, "inspections", f"v{version}")
+
+
+def snapshot_version():
+    """Версия данных готового снимка или None."""
+    try:
+        with open(_current_file()) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _schema():
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("object_id", pa.int64()),
+            ("date", pa.date32()),
+            ("method", pa.string()),
+            ("ml_label", pa.string()),
+            ("defect_found", pa.bool_()),
+            ("year", pa.int16()),
+            ("object_type", pa.string()),
+        ]
+    )
+
+
+def _partitioning():
+    return ds.partitioning(
+        pa.schema([("year", pa.int16()), ("object_type", pa.string())]), flavor="hive"
+    )
+
+
+@contextmanager
+def _consistent_read():
+    """Соединение, в котором версия данных и выгрузка видят одно состояние базы."""
+    with engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            # pysqlite не открывает транзакцию перед SELECT; в WAL все чтения
+            # после BEGIN видят базу на момент первого из них.
+            conn.exec_driver_sql("BEGIN")
+        else:
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+
+def _year_fingerprints(conn) -> dict:
+    """{год: [строк, Σ row_hash, Σ id, Σ row_hash объекта]} — меняется при любой
+    вставке, удалении или правке строки года и при смене типа её объекта."""
+    year = extract("year", Inspection.date)
+    rows = conn.execute(
+        select(
+            year,
+            func.count(),
+            func.sum(func.coalesce(Inspection.row_hash, 0) % _FINGERPRINT_MOD),
+            func.sum(Inspection.id % _FINGERPRINT_MOD),
+            func.sum(func.coalesce(Object.row_hash, 0) % _FINGERPRINT_MOD),
+        )
+        .join_from(Inspection, Object, Object.id == Inspection.object_id, isouter=True)
+        .group_by(year)
+    )
+    return {int(y): [int(value or 0) for value in sums] for y, *sums in rows}
+
+
+def _read_manifest(version) -> dict:
+    if version is None:
+        return {}
+    try:
+        with open(os.path.join(_version_dir(version), MANIFEST_FILE)) as f:
+            return {int(y): fp for y, fp in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def _link_tree(src: str, dst: str):
+    """Копия каталога раздела жёсткими ссылками (копированием, если ФС их не умеет)."""
+    def link(a, b):
+        try:
+            os.link(a, b)
+        except OSError:
+            shutil.copy2(a, b)
+
+    shutil.copytree(src, dst, copy_function=link)
+
+
+def _export_batches(conn, years):
+    """inspections + тип объекта за указанные годы кусками по SNAPSHOT_CHUNK_ROWS
+    в виде Arrow RecordBatch."""
+    query = (
+        select(
+            Inspection.id,
+            Inspection.object_id,
+            Inspection.date,
+            Inspection.method,
+            Inspection.ml_label,
+            Inspection.defect_found,
+            Object.object_type,
+        )
+        .join(Object, Object.id == Inspection.object_id, isouter=True)
+        .where(extract("year", Inspection.date).in_(years))
+    )
+    schema = _schema()
+    for chunk in pd.read_sql(query, conn, chunksize=SNAPSHOT_CHUNK_ROWS):
+        dates = pd.to_datetime(chunk["date"])
+        chunk["date"] = dates.dt.date
+        chunk["year"] = dates.dt.year.astype("int16")
+        chunk["defect_found"] = chunk["defect_found"].fillna(False).astype(bool)
+        chunk["object_type"] = chunk["object_type"].fillna("").astype(str)
+        yield pa.RecordBatch.from_pandas(chunk[schema.names], schema=schema, preserve_index=False)
+
+
+def sync_snapshot(force: bool = False):
+    """Обновляет снимок, если он отстал от версии данных. Возвращает версию снимка.
+
+    Вызывается после импорта (фоновые задачи) и может вызываться откуда угодно:
+    обновления выстраиваются в очередь, повторное для той же версии — no-op.
+    force=True — пересобрать все годы.
+    """
+    if not snapshot_available():
+        return None
+    with _sync_lock, _consistent_read() as conn:
+        version = get_db_version(conn)
+        current = snapshot_version()
+        if not force and current == version:
+            return version
+
+        fingerprints = _year_fingerprints(conn)
+        previous = {} if force else _read_manifest(current)
+        changed = [year for year, fp in fingerprints.items() if previous.get(year) != fp]
+
+        target = _version_dir(version)
+        shutil.rmtree(target, ignore_errors=True)
+        os.makedirs(target)
+        for year in fingerprints.keys() - set(changed):
+            _link_tree(os.path.join(_version_dir(current), f"year={year}"), os.path.join(target, f"year={year}"))
+        if changed:
+            ds.write_dataset(
+                _export_batches(conn, changed),
+                target,
+                schema=_schema(),
+                format="parquet",
+                partitioning=_partitioning(),
+                basename_template=f"part-v{version}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+            )
+        with open(os.path.join(target, MANIFEST_FILE), "w") as f:
+            json.dump(fingerprints, f)
+
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        tmp = _current_file() + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(version))
+        os.replace(tmp, _current_file())
+
+        # Старые версии больше никто не читает.
+        root = os.path.join(SNAPSHOT_DIR, "inspections")
+        for name in os.listdir(root):
+            if name != f"v{version}":
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        logger.info(
+            "Снимок inspections обновлён до версии %s (переписано лет: %d из %d)",
+            version, len(changed), len(fingerprints),
+        )
+        return version
+
+
+def sync_snapshot_background():
+    """Пересборка в фоне, если снимок отстал (например, после записей из бота).
+
+    Запросы не ждут её: пока снимок не готов, KPI считаются по SQL.
+    """
+    if not snapshot_available() or _sync_lock.locked():
+        return
+    threading.Thread(target=_sync_quietly, name="snapshot-sync", daemon=True).start()
+
+
+def _sync_quietly():
+    try:
+        sync_snapshot()
+    except Exception:
+        logger.exception("Не удалось обновить Parquet-снимок")
+
+
+# ---------------------------
+# KPI по снимку
+# ---------------------------
+
+def _dataset(version: int):
+    return ds.dataset(
+        _version_dir(version), schema=_schema(), format="parquet", partitioning=_partitioning()
+    )
+
+
+def _arrow_filter(methods, severities, date_from, date_to):
+    """Фильтр для pyarrow.dataset; условие по year отсекает целые разделы."""
+    expr = ds.scalar(True)
+    if methods:
+        expr &= ds.field("method").isin(list(methods))
+    if severities:
+        expr &= ds.field("ml_label").isin(list(severities))
+    if date_from:
+        expr &= (ds.field("year") >= date_from.year) & (ds.field("date") >= date_from)
+    if date_to:
+        expr &= (ds.field("year") <= date_to.year) & (ds.field("date") <= date_to)
+    return expr
+
+
+def _counts(table, key: str, top: int = None) -> dict:
+    """{значение: число строк} с порядком как у SQL-версии: по убыванию, затем по ключу."""
+    if table.num_rows == 0:
+        return {}
+    grouped = table.group_by(key).aggregate([(key, "count")]).to_pandas()
+    grouped = grouped.sort_values([f"{key}_count", key], ascending=[False, True])
+    if top:
+        grouped = grouped.head(top)
+    return dict(zip(grouped[key].tolist(), grouped[f"{key}_count"].astype(int).tolist()))
+
+
+def _kpis_arrow(version, methods, severities, date_from, date_to, top_limit) -> dict:
+    table = _dataset(version).to_table(
+        columns=["object_id", "method", "ml_label", "defect_found", "year"],
+        filter=_arrow_filter(methods, severities, date_from, date_to),
+    )
+    defects = table.filter(pc.field("defect_found"))
+    years = _counts(table, "year")
+    return {
+        "total_inspections": table.num_rows,
+        "total_defects": defects.num_rows,
+        "total_high": pc.sum(pc.equal(table["ml_label"], "high")).as_py() or 0,
+        "severity_counts": _counts(table, "ml_label"),
+        "method_defects": _counts(defects, "method"),
+        "year_counts": {int(y): years[y] for y in sorted(years)},
+        "top_objects": _counts(defects, "object_id", top_limit),
+    }
+
+
+def _kpis_duckdb(version, methods, severities, date_from, date_to, top_limit) -> dict:
+    where, params = ["TRUE"], []
+    if methods:
+        where.append(f"method IN ({', '.join('?' * len(methods))})")
+        params += list(methods)
+    if severities:
+        where.append(f"ml_label IN ({', '.join('?' * len(severities))})")
+        params += list(severities)
+    if date_from:
+        where.append("year >= ? AND date >= ?")
+        params += [date_from.year, date_from]
+    if date_to:
+        where.append("year <= ? AND date <= ?")
+        params += [date_to.year, date_to]
+    # Параметры в CREATE VIEW DuckDB не принимает — фильтр входит в каждый SELECT.
+    files = os.path.join(_version_dir(version), "**", "*.parquet").replace("'", "''")
+    source = f"read_parquet('{files}', hive_partitioning = true) WHERE {' AND '.join(where)}"
+
+    with duckdb.connect() as con:
+        def rows(columns, tail=""):
+            return con.execute(f"SELECT {columns} FROM {source} {tail}", params).fetchall()
+
+        total, defects, high = rows(
+            "count(*), count(*) FILTER (defect_found), count(*) FILTER (ml_label = 'high')"
+        )[0]
+        return {
+            "total_inspections": total,
+            "total_defects": defects or 0,
+            "total_high": high or 0,
+            "severity_counts": dict(rows("ml_label, count(*) c", "GROUP BY 1 ORDER BY c DESC, 1")),
+            "method_defects": dict(
+                rows("method, count(*) c", "AND defect_found GROUP BY 1 ORDER BY c DESC, 1")
+            ),
+            "year_counts": {int(y): n for y, n in rows("year, count(*)", "GROUP BY 1 ORDER BY 1")},
+            "top_objects": dict(
+                rows(
+                    "object_id, count(*) c",
+                    f"AND defect_found GROUP BY 1 ORDER BY c DESC, 1 LIMIT {int(top_limit)}",
+                )
+            ),
+        }
+
+
+def snapshot_kpis(version: int, methods, severities, date_from, date_to, top_limit: int):
+    """KPI по снимку, если он есть и совпадает с версией данных; иначе None."""
+    if not snapshot_available():
+        return None
+    if snapshot_version() != version:
+        sync_snapshot_background()
+        return None
+    try:
+        if duckdb is not None:
+            return _kpis_duckdb(version, methods, severities, date_from, date_to, top_limit)
+        return _kpis_arrow(version, methods, severities, date_from, date_to, top_limit)
+    except Exception:
+        # Снимок могли удалить или пересобрать между проверкой и чтением.
+        logger.exception("Чтение снимка не удалось, считаем KPI по SQL")
+        return None
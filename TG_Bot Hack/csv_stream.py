@@ -0,0 +1,149 @@
+"""CSV файлын Telegram серверінен ағынмен оқу.
+
+Файл толық жүктеліп, бір жолға декодталмайды: байттар келген сайын
+толық CSV жазбаларына бөлінеді де, chunk_rows жазбадан тұратын бөліктер
+бірден беріледі. Жадта бір уақытта тек бір бөлік тұрады.
+"""
+
+import codecs
+import csv
+import hashlib
+import io
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+# Анкета өрістерінен басқа Streamlit импорты түсінетін баламалы атаулар
+COLUMN_ALIASES = {"name", "object_name", "object_type", "description", "pipeline", "year", "material"}
+
+# Файл түрін анықтайтын міндетті бағандар
+REQUIRED_COLUMNS = {
+    "diagnostics": ("object_id", "date", "severity"),
+    "objects": ("object_id", "lat", "lon"),
+}
+
+
+def parse_header(line: str) -> List[str]:
+    return [name.strip().strip('"').lower() for name in line.split(",")]
+
+
+def records_to_dicts(header: str, records: List[str]) -> List[Dict[str, str]]:
+    """Бөлікті бағандар бойынша dict тізіміне айналдырады (тырнақтар ескеріледі)."""
+    return list(csv.DictReader(io.StringIO("\n".join([header, *records]))))
+
+
+def detect_kind(
+    header: List[str],
+    object_fields: Iterable[str],
+    diag_fields: Iterable[str],
+) -> Tuple[Optional[str], List[str]]:
+    """Тақырып бойынша файл түрі ("objects"/"diagnostics" немесе None) және таныс емес бағандар."""
+    columns = set(header)
+    kind = next(
+        (name for name, required in REQUIRED_COLUMNS.items() if columns.issuperset(required)),
+        None,
+    )
+    known = set(object_fields) | set(diag_fields) | COLUMN_ALIASES
+    unknown = [name for name in header if name not in known]
+    return kind, unknown
+
+
+class RecordSplitter:
+    """Байттарды толық CSV жазбаларына бөледі.
+
+    Тырнақ ішіндегі жаңа жол жазбаны бөлмейді. Алдымен UTF-8 (BOM-мен де),
+    ол сәтсіз болса — файлдың қалғаны latin-1 ретінде оқылады.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._tail = ""
+        self._pending: List[str] = []
+        self._quotes = 0
+
+    def _decode(self, data: bytes, final: bool) -> str:
+        # Алдыңғы бөліктің соңындағы толық емес UTF-8 таңбасының байттары
+        # декодерде қалады — latin-1-ге ауысқанда оларды да қайта оқимыз.
+        buffered = self._decoder.getstate()[0]
+        try:
+            return self._decoder.decode(data, final)
+        except UnicodeDecodeError:
+            self._decoder = codecs.getincrementaldecoder("latin-1")()
+            return self._decoder.decode(buffered + data, final)
+
+    def _flush(self) -> str:
+        record = "\n".join(self._pending).rstrip("\r")
+        self._pending, self._quotes = [], 0
+        return record
+
+    def feed(self, data: bytes, final: bool = False) -> List[str]:
+        records = []
+        # Соңғы бөлшек толық жол емес: оны келесі feed-ке дейін ұстаймыз.
+        *lines, self._tail = (self._tail + self._decode(data, final)).split("\n")
+        if final and self._tail:
+            lines.append(self._tail)
+            self._tail = ""
+        for line in lines:
+            self._pending.append(line)
+            self._quotes += line.count('"')
+            # Тырнақ ашық қалса, жазба келесі жолда жалғасады.
+            if self._quotes % 2 == 0:
+                records.append(self._flush())
+        if final and self._pending:
+            records.append(self._flush())
+        return [record for record in records if record.strip()]
+
+
+class CsvStream:
+    """stream.read() — (header, records) жұптары: CSV тақырыбы және жазбалар бөлігі.
+
+    Тақырып келген бойда бір рет бос бөлік (header, []) беріледі: тақырыпты
+    тексеріп, қате файлды жүктеуді бірден тоқтатуға болады. Жүктеу
+    аяқталғанда bytes_read, rows, chunks, sha256 толтырылады.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str, chunk_rows: int):
+        self.client = client
+        self.url = url
+        self.chunk_rows = max(chunk_rows, 1)
+        self.header: Optional[str] = None
+        self.bytes_read = 0
+        self.rows = 0
+        self.chunks = 0
+        self._digest = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def _emit(self, chunk: List[str]) -> Tuple[str, List[str]]:
+        self.rows += len(chunk)
+        self.chunks += 1
+        return self.header, chunk
+
+    async def read(self) -> AsyncIterator[Tuple[str, List[str]]]:
+        splitter = RecordSplitter()
+        batch: List[str] = []
+
+        async def records():
+            async with self.client.stream("GET", self.url) as resp:
+                resp.raise_for_status()
+                async for data in resp.aiter_bytes():
+                    self.bytes_read += len(data)
+                    self._digest.update(data)
+                    for record in splitter.feed(data):
+                        yield record
+            for record in splitter.feed(b"", final=True):
+                yield record
+
+        async for record in records():
+            if self.header is None:
+                self.header = record
+                yield self.header, []
+                continue
+            batch.append(record)
+            if len(batch) >= self.chunk_rows:
+                yield self._emit(batch)
+                batch = []
+        if batch:
+            yield self._emit(batch)
@@ -0,0 +1,106 @@
+"""Анкеталар мен CSV жолдарын IntegrityOS базасына тікелей жазу.
+
+Make арқылы айналмай, IntegrityHack/utils ішіндегі ingest_records
+(Streamlit импортымен бірдей тексеру мен жазу) шақырылады. Бір-біріне
+жақын келген жазбалар MicroBatcher-де бір транзакцияға жиналады.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IngestFn = Callable[[str, List[Dict[str, Any]]], Any]
+
+
+def load_ingest(integrity_dir: str) -> IngestFn:
+    """IntegrityHack кодын sys.path-қа қосып, базаны дайындап, ingest_records қайтарады.
+
+    DATABASE_URL берілмесе, Streamlit қолданатын IntegrityHack/integrity.db алынады.
+    """
+    integrity_dir = os.path.abspath(integrity_dir)
+    if integrity_dir not in sys.path:
+        sys.path.insert(0, integrity_dir)
+    os.environ.setdefault(
+        "DATABASE_URL", f"sqlite:///{os.path.join(integrity_dir, 'integrity.db')}"
+    )
+
+    from utils.db import init_db
+    from utils.import_utils import ingest_records
+
+    init_db()
+    return ingest_records
+
+
+class MicroBatcher:
+    """Жазбаларды түрі бойынша max_delay секунд (немесе max_size жазба) жинап,
+    бір ingest шақыруымен жазады. submit() өз жазбалары жазылғанда аяқталады."""
+
+    def __init__(self, ingest: IngestFn, max_delay: float = 0.5, max_size: int = 500):
+        self.ingest = ingest
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self._pending: Dict[str, List[Tuple[List[Dict[str, Any]], asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+
+    async def submit(self, kind: str, records: List[Dict[str, Any]]):
+        """Жазбаларды кезекке қосып, пакет жазылғанша күтеді; пакеттің ImportStats-ын қайтарады."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(kind, [])
+        pending.append((records, future))
+
+        if sum(len(r) for r, _ in pending) >= self.max_size:
+            self._flush(kind)
+        elif kind not in self._timers:
+            self._timers[kind] = loop.call_later(self.max_delay, self._flush, kind)
+        return await future
+
+    def _flush(self, kind: str) -> None:
+        timer = self._timers.pop(kind, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(kind, [])
+        if pending:
+            task = asyncio.get_running_loop().create_task(self._write(kind, pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, kind: str, pending: List[Tuple[List[Dict[str, Any]], asyncio.Future]]) -> None:
+        records = [record for batch, _ in pending for record in batch]
+        try:
+            # Жазу синхронды (SQLAlchemy) — event loop-ты бөгемеу үшін бөлек ағында.
+            stats = await asyncio.to_thread(self.ingest, kind, records)
+        except Exception as e:
+            logger.exception("Direct ingest error (%s, %d жазба)", kind, len(records))
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in pending:
+            if not future.done():
+                future.set_result(stats)
+
+    async def close(self) -> None:
+        """Кезекте қалғанын жазып, аяқталуын күтеді."""
+        for kind in list(self._pending):
+            self._flush(kind)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def open_batcher(enabled: bool, integrity_dir: str, max_delay: float, max_size: int) -> Optional[MicroBatcher]:
+    """DIRECT_INGEST қосулы болса, MicroBatcher; IntegrityHack табылмаса — None және ескерту."""
+    if not enabled:
+        return None
+    try:
+        ingest = load_ingest(integrity_dir)
+    except Exception as e:
+        logger.warning("Direct ingest өшірілді: IntegrityHack жүктелмеді (%s)", e)
+        return None
+    logger.info("Direct ingest: %s", os.environ.get("DATABASE_URL"))
+    return MicroBatcher(ingest, max_delay=max_delay, max_size=max_size)
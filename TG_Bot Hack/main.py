@@ -1,8 +1,10 @@
+import asyncio
 import logging
 import os
-from typing import Any, Dict, List, Tuple
+from contextlib import aclosing
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
+import httpx
 from dotenv import load_dotenv
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
@@ -14,6 +16,10 @@ from telegram.ext import (
     filters,
 )
 
+from csv_stream import CsvStream, detect_kind, parse_header, records_to_dicts
+from ingest import MicroBatcher, open_batcher
+from outbox import Outbox, OutboxItem, OutboxWorker
+
 # Load .env early so MAKE_WEBHOOK picks it up
 load_dotenv()
 
@@ -22,6 +28,26 @@ MAKE_WEBHOOK = os.getenv(
     "MAKE_WEBHOOK_URL",
     "https://hook.eu2.make.com/rmxwms8d9mauollpe776ntpd4ucgnkzp",
 )
+MAKE_TIMEOUT = float(os.getenv("MAKE_TIMEOUT", "10"))
+# Make-ке бір уақытта кететін сұраулар саны
+MAKE_CONCURRENCY = int(os.getenv("MAKE_CONCURRENCY", "8"))
+# Жіберілмеген payload-тар кезегі (SQLite файлы)
+MAKE_OUTBOX_PATH = os.getenv("MAKE_OUTBOX_PATH", "make_outbox.db")
+# 1 — бір хабар бір сұраумен (бұрынғы формат); >1 — {"type": "batch", "items": [...]}
+MAKE_BATCH_SIZE = int(os.getenv("MAKE_BATCH_SIZE", "1"))
+MAKE_RETRY_BASE = float(os.getenv("MAKE_RETRY_BASE", "2"))
+MAKE_RETRY_MAX = float(os.getenv("MAKE_RETRY_MAX", "300"))
+# CSV Make-ке осынша жолдан тұратын бөліктермен кетеді
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "500"))
+# Анкета мен CSV жолдарын IntegrityOS базасына тікелей жазу (Make-ке жіберу де қала береді)
+DIRECT_INGEST = os.getenv("DIRECT_INGEST", "0").lower() in ("1", "true", "yes")
+INTEGRITYHACK_DIR = os.getenv(
+    "INTEGRITYHACK_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "IntegrityHack"),
+)
+# Осы уақыт ішінде келген жазбалар бір транзакцияда жазылады
+INGEST_MAX_DELAY = float(os.getenv("INGEST_MAX_DELAY", "0.5"))
+INGEST_MAX_SIZE = int(os.getenv("INGEST_MAX_SIZE", "500"))
 
 # --- Logging ---
 logging.basicConfig(
@@ -94,16 +120,126 @@ def menu_keyboard() -> InlineKeyboardMarkup:
     )
 
 
-def send_to_make(payload: Dict[str, Any]) -> str:
-    """Send payload to Make webhook; return status string."""
-    try:
-        resp = requests.post(MAKE_WEBHOOK, json=payload, timeout=10)
-        if resp.ok:
-            return "жіберілді"
-        return f"қате {resp.status_code}"
-    except Exception as e:
-        logger.warning("Make webhook error: %s", e)
-        return f"қате: {e}"
+class MakeDispatcher:
+    """Make webhook-қа асинхронды жіберу.
+
+    Бір ортақ httpx.AsyncClient (keep-alive байланыстар пулы) және
+    семафор: бір уақытта MAKE_CONCURRENCY сұраудан артық кетпейді,
+    баяу webhook event loop-ты тоқтатпайды.
+    """
+
+    def __init__(self, url: str, concurrency: int = MAKE_CONCURRENCY, timeout: float = MAKE_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._limits = httpx.Limits(
+            max_connections=concurrency, max_keepalive_connections=concurrency
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(timeout=self.timeout, limits=self._limits)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def send(self, payload: Dict[str, Any], key: str = "") -> Tuple[bool, str]:
+        """Send payload to Make webhook; return (ok, status string)."""
+        headers = {"Idempotency-Key": key} if key else None
+        async with self._semaphore:
+            try:
+                resp = await self._client.post(self.url, json=payload, headers=headers)
+                if resp.is_success:
+                    return True, "жіберілді"
+                return False, f"қате {resp.status_code}"
+            except Exception as e:
+                logger.warning("Make webhook error: %s", e)
+                return False, f"қате: {e}"
+
+    async def send_batch(self, items: List[OutboxItem]) -> Tuple[bool, str]:
+        """Бір жазба — бұрынғыдай жеке payload, бірнешеу — бір batch сұрау."""
+        if len(items) == 1:
+            return await self.send(items[0].payload, items[0].key)
+        payload = {"type": "batch", "items": [item.payload for item in items]}
+        return await self.send(payload, ",".join(item.key for item in items))
+
+
+def idempotency_key(update: Update, form: str) -> str:
+    """chat_id + форма түрі + хабар уақыты: Telegram update-ті қайта жіберсе де, кілт өзгермейді."""
+    message = update.effective_message
+    chat_id = update.effective_chat.id if update.effective_chat else ""
+    stamp = int(message.date.timestamp()) if message and message.date else 0
+    message_id = message.message_id if message else 0
+    return f"{chat_id}:{form}:{stamp}:{message_id}"
+
+
+def dispatch_to_make(
+    context: ContextTypes.DEFAULT_TYPE,
+    update: Update,
+    payload: Dict[str, Any],
+    label: str,
+    part: str = "",
+    quiet: bool = False,
+) -> None:
+    """Payload-ты outbox-қа жазады; жіберу нәтижесі чатқа бөлек хабармен келеді.
+
+    part — бір хабардан шыққан бірнеше payload-тың кілтін ажыратады,
+    quiet=True — бұл payload туралы чатқа хабарламаймыз.
+    """
+    form = payload.get("kind") or payload.get("type", "")
+    key = idempotency_key(update, form) + (f":{part}" if part else "")
+    payload["idempotency_key"] = key
+    chat_id = None if quiet else payload.get("chat_id")
+    if context.bot_data["outbox"].put(key, payload, chat_id, label):
+        context.bot_data["outbox_worker"].wake()
+    else:
+        logger.info("Outbox: %s бұрын кезекке қойылған", key)
+
+
+def ingest_direct(
+    context: ContextTypes.DEFAULT_TYPE,
+    update: Update,
+    kind: str,
+    records: List[Dict[str, Any]],
+    label: str,
+) -> Optional[asyncio.Task]:
+    """DIRECT_INGEST қосулы болса, жазбаларды фонда базаға жазады.
+
+    label бос болмаса, нәтиже чатқа бөлек хабармен келеді. Тапсырманы
+    қайтарады (немесе None), бірнеше бөліктің қорытындысын күту үшін.
+    """
+    batcher: Optional[MicroBatcher] = context.bot_data.get("ingest")
+    if batcher is None or kind not in ("objects", "diagnostics") or not records:
+        return None
+    chat_id = update.effective_chat.id if update.effective_chat else None
+
+    async def deliver():
+        stats = await batcher.submit(kind, records)
+        if label and chat_id is not None:
+            await context.bot.send_message(
+                chat_id,
+                f"{label} IntegrityOS базасына жазылды "
+                f"(пакетте {stats.written} жазылды, {stats.rejected} қабылданбады).",
+            )
+        return stats
+
+    return context.application.create_task(deliver(), update=update)
+
+
+async def notify_delivery(app: Application, item: OutboxItem, ok: bool, status: str) -> None:
+    if item.chat_id is None:
+        return
+    if ok:
+        text = f"{item.label} Make-ке {status}"
+    else:
+        text = f"{item.label} Make-ке әзірге жетпеді ({status}). Кезекте тұр, кейін қайта жіберіледі."
+    await app.bot.send_message(item.chat_id, text)
 
 
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -119,7 +255,7 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Қалай қолдану:\n"
         "- /start басып, Объект немесе Диагностика анкетасын таңдаңыз.\n"
         "- Сұрақтарға кезекпен жауап беріңіз; соңында Make-ке жіберіледі.\n"
-        "- CSV файл жіберсеңіз, файл мазмұны Make-ке өтеді.\n"
+        f"- CSV файл жіберсеңіз, ол {CSV_CHUNK_ROWS} жолдық бөліктермен Make-ке өтеді.\n"
         f"Make webhook: {MAKE_WEBHOOK}"
     )
     await update.message.reply_text(text)
@@ -140,8 +276,8 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         "text": content,
         "chat_id": update.effective_chat.id if update.effective_chat else None,
     }
-    status = send_to_make(payload)
-    await update.message.reply_text(f"Make-ке {status}\n\nАнкета үшін /start басыңыз.")
+    dispatch_to_make(context, update, payload, "Хабар")
+    await update.message.reply_text("Make-ке жіберілуде...\n\nАнкета үшін /start басыңыз.")
 
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -152,21 +288,96 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("Тек CSV файл қабылдаймын.")
         return
 
+    # Файл толық жүктелмейді: жазбалар келген сайын CSV_CHUNK_ROWS жолдық
+    # бөліктерге бөлініп, кезекке бірден қойылады. Соңында — манифест.
     file = await doc.get_file()
-    content_bytes = await file.download_as_bytearray()
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    upload_id = idempotency_key(update, "csv")
+    stream = CsvStream(context.bot_data["make"].client, file.file_path, CSV_CHUNK_ROWS)
+    kind = None
+    ingests: List[asyncio.Task] = []
+
     try:
-        content_text = content_bytes.decode("utf-8")
-    except Exception:
-        content_text = content_bytes.decode("latin-1", errors="replace")
+        async with aclosing(stream.read()) as chunks:
+            async for header, records in chunks:
+                if kind is None:
+                    kind, unknown = detect_kind(
+                        parse_header(header),
+                        (key for key, _ in OBJECT_FIELDS),
+                        (key for key, _ in DIAG_FIELDS),
+                    )
+                    if kind is None:
+                        await update.message.reply_text(
+                            "CSV тақырыбы танылмады. Объектілер үшін object_id, lat, lon, "
+                            "диагностика үшін object_id, date, severity бағандары керек."
+                        )
+                        return
+                    if unknown:
+                        await update.message.reply_text(
+                            f"Белгісіз бағандар (өзгеріссіз жіберіледі): {', '.join(unknown)}"
+                        )
+                if not records:
+                    continue
+                payload = {
+                    "type": "csv_chunk",
+                    "upload_id": upload_id,
+                    "file_name": doc.file_name,
+                    "kind": kind,
+                    "chunk": stream.chunks,
+                    "rows": len(records),
+                    "content": "\n".join([header, *records]),
+                    "chat_id": chat_id,
+                }
+                dispatch_to_make(context, update, payload, "CSV", part=f"chunk{stream.chunks}", quiet=True)
+                task = ingest_direct(context, update, kind, records_to_dicts(header, records), "")
+                if task is not None:
+                    ingests.append(task)
+    except httpx.HTTPError as e:
+        logger.warning("CSV download error: %s", e)
+        await update.message.reply_text(f"CSV жүктеу қатесі: {e}")
+        return
 
-    payload = {
-        "type": "csv",
+    if stream.header is None:
+        await update.message.reply_text("CSV файл бос.")
+        return
+
+    manifest = {
+        "type": "csv_manifest",
+        "upload_id": upload_id,
         "file_name": doc.file_name,
-        "content": content_text,
-        "chat_id": update.effective_chat.id if update.effective_chat else None,
+        "kind": kind,
+        "chunks": stream.chunks,
+        "rows": stream.rows,
+        "bytes": stream.bytes_read,
+        "sha256": stream.sha256,
+        "chat_id": chat_id,
     }
-    status = send_to_make(payload)
-    await update.message.reply_text(f"CSV Make-ке {status}")
+    dispatch_to_make(context, update, manifest, "CSV", part="manifest")
+    if ingests:
+        context.application.create_task(
+            report_csv_ingest(context, chat_id, ingests, stream.rows), update=update
+        )
+    await update.message.reply_text(
+        f"CSV: {stream.rows} жол, {stream.chunks} бөлік Make-ке жіберілуде..."
+    )
+
+
+async def report_csv_ingest(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: Optional[int],
+    ingests: List[asyncio.Task],
+    rows: int,
+) -> None:
+    """CSV бөліктерінің базаға жазылуын күтіп, бір қорытынды хабар жібереді."""
+    results = await asyncio.gather(*ingests, return_exceptions=True)
+    failed = sum(isinstance(result, Exception) for result in results)
+    if chat_id is None:
+        return
+    if failed:
+        text = f"CSV: {failed}/{len(results)} бөлік IntegrityOS базасына жазылмады."
+    else:
+        text = f"CSV: {rows} жол IntegrityOS базасына жазылды, картада көрінеді."
+    await context.bot.send_message(chat_id, text)
 
 
 # ---------- Анкета ----------
@@ -240,7 +451,8 @@ async def finalize_form(carrier: Update, context: ContextTypes.DEFAULT_TYPE) ->
         "data": form,
         "chat_id": carrier.effective_chat.id if carrier.effective_chat else None,
     }
-    status = send_to_make(payload)
+    dispatch_to_make(context, carrier, payload, "Анкета")
+    ingest_direct(context, carrier, kind, [dict(form)], "Анкета")
 
     buttons = InlineKeyboardMarkup(
         [
@@ -249,7 +461,7 @@ async def finalize_form(carrier: Update, context: ContextTypes.DEFAULT_TYPE) ->
         ]
     )
     reply = (
-        f"Анкета Make-ке {status}.\n"
+        "Анкета Make-ке жіберілуде.\n"
         f"object_id: {obj_id or '(пусто)'} | diag_id: {diag_id or '(пусто)'}\n"
         "Келесі: Streamlit ашыңыз немесе жаңа анкетаны бастаңыз."
     )
@@ -266,12 +478,55 @@ async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     context.user_data.clear()
     await update.message.reply_text("Анкета тоқтатылды. /start басып қайта бастаңыз.", reply_markup=menu_keyboard())
 
+async def on_startup(app: Application) -> None:
+    dispatcher = MakeDispatcher(MAKE_WEBHOOK)
+    await dispatcher.start()
+    outbox = Outbox(MAKE_OUTBOX_PATH)
+    worker = OutboxWorker(
+        outbox,
+        send_batch=dispatcher.send_batch,
+        notify=lambda item, ok, status: notify_delivery(app, item, ok, status),
+        batch_size=MAKE_BATCH_SIZE,
+        concurrency=MAKE_CONCURRENCY,
+        retry_base=MAKE_RETRY_BASE,
+        retry_cap=MAKE_RETRY_MAX,
+    )
+    # Алдыңғы іске қосудан қалған жазбалар да осы жерден жіберіледі.
+    worker.start()
+    app.bot_data.update(make=dispatcher, outbox=outbox, outbox_worker=worker)
+    app.bot_data["ingest"] = open_batcher(
+        DIRECT_INGEST, INTEGRITYHACK_DIR, INGEST_MAX_DELAY, INGEST_MAX_SIZE
+    )
+    logger.info("Make outbox: %s (%d жазба кезекте)", MAKE_OUTBOX_PATH, outbox.size())
+
+
+async def on_shutdown(app: Application) -> None:
+    batcher: Optional[MicroBatcher] = app.bot_data.pop("ingest", None)
+    if batcher is not None:
+        await batcher.close()
+    worker: Optional[OutboxWorker] = app.bot_data.pop("outbox_worker", None)
+    if worker is not None:
+        await worker.stop()
+    dispatcher: Optional[MakeDispatcher] = app.bot_data.pop("make", None)
+    if dispatcher is not None:
+        await dispatcher.stop()
+    outbox: Optional[Outbox] = app.bot_data.pop("outbox", None)
+    if outbox is not None:
+        outbox.close()
+
+
 def main() -> None:
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
         raise RuntimeError("TELEGRAM_BOT_TOKEN not set. Add it to .env")
 
-    app = Application.builder().token(token).build()
+    app = (
+        Application.builder()
+        .token(token)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("help", cmd_help))
     app.add_handler(CommandHandler("cancel", cmd_cancel))
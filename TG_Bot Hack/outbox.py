@@ -0,0 +1,185 @@
+"""Make-ке кететін payload-тардың жергілікті кезегі (SQLite outbox).
+
+Хендлерлер payload-ты кезекке жазады да, бірден жауап береді.
+OutboxWorker фонда кезекті пакеттермен босатады: сәтті жіберілгені
+өшіріледі, сәтсізі экспоненциалды кідіріспен қайта жіберіледі.
+Бот тоқтап қалса да, жіберілмегендер файлда сақталады.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OutboxItem:
+    id: int
+    key: str
+    payload: Dict[str, Any]
+    chat_id: Optional[int]
+    label: str
+    attempts: int
+
+
+def backoff_delay(attempts: int, base: float, cap: float) -> float:
+    """base * 2^(attempts-1), cap-пен шектелген, бір сәтте бәрі қайта келмеуі үшін jitter қосылады."""
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Outbox:
+    """SQLite файлындағы кезек. key бірегей — бір хабар екі рет жазылмайды."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                chat_id INTEGER,
+                label TEXT NOT NULL DEFAULT '',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_next_at ON outbox (next_at)")
+
+    def put(self, key: str, payload: Dict[str, Any], chat_id: Optional[int], label: str) -> bool:
+        """Кезекке қосады; осындай key бұрыннан бар болса, False."""
+        now = time.time()
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO outbox (key, payload, chat_id, label, next_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, json.dumps(payload, ensure_ascii=False), chat_id, label, now, now),
+        )
+        return cur.rowcount == 1
+
+    def due(self, limit: int) -> List[OutboxItem]:
+        """Жіберу уақыты келген жазбалар, ескісі бірінші."""
+        rows = self._conn.execute(
+            "SELECT id, key, payload, chat_id, label, attempts FROM outbox "
+            "WHERE next_at <= ? ORDER BY id LIMIT ?",
+            (time.time(), limit),
+        ).fetchall()
+        return [
+            OutboxItem(id=r[0], key=r[1], payload=json.loads(r[2]), chat_id=r[3], label=r[4], attempts=r[5])
+            for r in rows
+        ]
+
+    def next_delay(self, default: float) -> float:
+        """Келесі жазбаға дейін қанша секунд күту керек (кезек бос болса — default)."""
+        row = self._conn.execute("SELECT MIN(next_at) FROM outbox").fetchone()
+        if row[0] is None:
+            return default
+        return min(default, max(row[0] - time.time(), 0.0))
+
+    def done(self, ids: List[int]) -> None:
+        self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def retry(self, items: List[OutboxItem], error: str, base: float, cap: float) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "UPDATE outbox SET attempts = ?, next_at = ?, last_error = ? WHERE id = ?",
+            [
+                (item.attempts + 1, now + backoff_delay(item.attempts + 1, base, cap), error, item.id)
+                for item in items
+            ],
+        )
+
+    def size(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+SendBatch = Callable[[List[OutboxItem]], Awaitable[Tuple[bool, str]]]
+Notify = Callable[[OutboxItem, bool, str], Awaitable[None]]
+
+
+class OutboxWorker:
+    """Кезекті фонда босатады: batch_size жазбадан тұратын пакеттер,
+    бір уақытта concurrency пакеттен артық емес."""
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        send_batch: SendBatch,
+        notify: Notify,
+        batch_size: int = 1,
+        concurrency: int = 1,
+        retry_base: float = 2.0,
+        retry_cap: float = 300.0,
+        idle: float = 5.0,
+    ):
+        self.outbox = outbox
+        self.send_batch = send_batch
+        self.notify = notify
+        self.batch_size = max(batch_size, 1)
+        self.concurrency = max(concurrency, 1)
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.idle = idle
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="make-outbox")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self) -> None:
+        """Жаңа жазба түсті — күтуді тоқтатып, кезекті қазір тексеру."""
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            # Тазалау due()-дан бұрын: арада түскен wake() жоғалмайды.
+            self._wake.clear()
+            items = self.outbox.due(self.batch_size * self.concurrency)
+            if not items:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.outbox.next_delay(self.idle))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+            await asyncio.gather(*(self._deliver(batch) for batch in batches))
+
+    async def _deliver(self, batch: List[OutboxItem]) -> None:
+        ok, status = await self.send_batch(batch)
+        if ok:
+            self.outbox.done([item.id for item in batch])
+        else:
+            self.outbox.retry(batch, status, self.retry_base, self.retry_cap)
+            logger.warning("Outbox: %d жазба кейін қайта жіберіледі (%s)", len(batch), status)
+
+        for item in batch:
+            # Қате туралы тек бірінші рет хабарлаймыз, әр қайталауда емес.
+            if ok or item.attempts == 0:
+                try:
+                    await self.notify(item, ok, status)
+                except Exception as e:
+                    logger.warning("Outbox notify error: %s", e)